@@ -19,8 +19,10 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 __all__ = ["sprites"]
 
+import os
 import UEFfile
 import makedfs
+from levelutils import pack_rows, unpack_rows
 
 from Repton.sprites import Reader, BBCReader
 
@@ -30,6 +32,24 @@ class NotFound(Exception):
 class IncorrectSize(Exception):
     pass
 
+# The values combined with each byte in a group of 32 bytes when scrambling
+# data. The values are added to a base value that decreases by 32 for each
+# group, so the whole key repeats every 256 bytes.
+scramble_offsets = [0x05, 0x04, 0x07, 0x06, 0x01, 0x00, 0x03, 0x02,
+                    0x0d, 0x0c, 0x0f, 0x0e, 0x09, 0x08, 0x0b, 0x0a,
+                    0x15, 0x14, 0x17, 0x16, 0x11, 0x10, 0x13, 0x12,
+                    0x1d, 0x1c, 0x1f, 0x1e, 0x19, 0x18, 0x1b, 0x1a]
+
+def make_scramble_key():
+
+    key = []
+    for v in range(0xe0, -1, -32):
+        key += [v + o for o in scramble_offsets]
+    
+    return bytes(key)
+
+scramble_key = make_scramble_key()
+
 class Repton:
 
     colours = [(255,0,0), (0,0,255), (255,0,255), (255,0,0),
@@ -40,165 +60,160 @@ class Repton:
     
         if uef_or_ssd_file.endswith("uef"):
         
-            # Acorn Electron version
-            
-            self.uef = UEFfile.UEFfile(uef_or_ssd_file)
-            self.file_number = 0
-            
-            for details in self.uef.contents:
-            
-                if details["name"] == b"REPTON2":
-                    break
-                
-                self.file_number += 1
-            else:
-                raise NotFound
-            
-            self.data = details["data"]
-            
-            if len(self.data) != 0x4a00:
-                raise IncorrectSize
-            
-            # Certain releases of Repton contain scrambled data. Unscramble it
-            # using a reversible scrambling routine.
-            if len(self.uef.contents) == 4:
-                self.data = self.scramble(self.data)
-            
-            self.levels_start = 0x2c00
-            self.sprites_start = 0x2500
-            self.sprites_finish = 0x2c00
-            
-            self.version = "Electron"
-            self.Reader = Reader
-            
-            self.tile_width = 8
-            self.tile_height = 16
+            self.read_uef(UEFfile.UEFfile(uef_or_ssd_file))
         
         elif uef_or_ssd_file.endswith("ssd"):
         
-            # BBC Micro DFS disk version
-            
-            self.ssd = makedfs.Disk()
-            self.ssd.open(open(uef_or_ssd_file))
-            self.file_number = 0
-            
-            cat = self.ssd.catalogue()
-            title, files = cat.read()
-            
-            for details in files:
-            
-                if details.name == b"D.REPTON2":
-                    break
-                
-                self.file_number += 1
-            else:
-                raise NotFound
-            
-            self.data = details.data
-            
-            if len(self.data) != 0x5600:
-                raise IncorrectSize
-            
-            self.levels_start = 0x3800
-            self.sprites_start = 0x25c0
-            self.sprites_finish = 0x3600
-            
-            self.version = "BBC"
-            self.Reader = BBCReader
-            
-            self.tile_width = 16
-            self.tile_height = 32
+            self.read_ssd(makedfs.Disk.from_fileobj(open(uef_or_ssd_file, "rb")))
         
         else:
             raise NotFound
     
-    def scramble(self, data):
+    @classmethod
+    def from_bytes(cls, data):
     
-        # Keep the first byte.
-        s = data[:1]
-        
-        d = []
-        v = 0xe0
-        o = [0x05, 0x04, 0x07, 0x06, 0x01, 0x00, 0x03, 0x02,
-             0x0d, 0x0c, 0x0f, 0x0e, 0x09, 0x08, 0x0b, 0x0a,
-             0x15, 0x14, 0x17, 0x16, 0x11, 0x10, 0x13, 0x12,
-             0x1d, 0x1c, 0x1f, 0x1e, 0x19, 0x18, 0x1b, 0x1a]
-        i = 0
-        while i < len(data):
-        
-            b = data[i:i+32]
-            j = 0
-            while j < 32:
-                d.append(b[j] ^ (v + o[j]))
-                j += 1
-            
-            if v == 0:
-                v = 0xe0
-            else:
-                v -= 32
-            
-            i += 32
+        # Identify the format of the data from its contents instead of a
+        # file name.
+        if UEFfile.is_uef(data):
+            return cls.from_uef(UEFfile.UEFfile.from_bytes(data))
+        elif makedfs.is_dfs_image(data):
+            return cls.from_disk(makedfs.Disk.from_bytes(data))
+        else:
+            raise NotFound
+    
+    @classmethod
+    def from_fileobj(cls, file_object):
+    
+        return cls.from_bytes(file_object.read())
+    
+    @classmethod
+    def from_uef(cls, uef):
+    
+        repton = cls.__new__(cls)
+        repton.read_uef(uef)
+        return repton
+    
+    @classmethod
+    def from_disk(cls, disk):
+    
+        repton = cls.__new__(cls)
+        repton.read_ssd(disk)
+        return repton
+    
+    @classmethod
+    def in_index(cls, index):
+    
+        # Identify the game from the name and length of its data file in a
+        # UEFIndex without reading the file's data.
+        file_position = index.find_file(b"REPTON2")
         
-        return s + bytes(d[1:])
+        return file_position != None and \
+               index.contents[file_position]["length"] == 0x4a00
     
-    def read_levels(self):
+    def read_uef(self, uef):
     
-        levels = []
+        # Acorn Electron version
         
-        for number in range(12):
+        self.uef = uef
+        self.file_number = 0
+        
+        for details in self.uef.contents:
+        
+            if details["name"] == b"REPTON2":
+                break
+            
+            self.file_number += 1
+        else:
+            raise NotFound
+        
+        self.data = details["data"]
         
-            address = self.levels_start + (number * 640)
-            level = []
+        if len(self.data) != 0x4a00:
+            raise IncorrectSize
+        
+        # Certain releases of Repton contain scrambled data. Unscramble it
+        # using a reversible scrambling routine.
+        if len(self.uef.contents) == 4:
+            self.data = self.scramble(self.data)
+        
+        self.levels_start = 0x2c00
+        self.sprites_start = 0x2500
+        self.sprites_finish = 0x2c00
+        
+        self.version = "Electron"
+        self.Reader = Reader
+        
+        self.tile_width = 8
+        self.tile_height = 16
     
-            for row in range(32):
+    def read_ssd(self, disk):
     
-                current = 0
-                offset = 0
-                level.append([])
+        # BBC Micro DFS disk version
+        
+        self.ssd = disk
+        self.file_number = 0
+        
+        cat = self.ssd.catalogue()
+        title, files = cat.read()
+        
+        for details in files:
+        
+            if details.name == b"D.REPTON2":
+                break
+            
+            self.file_number += 1
+        else:
+            raise NotFound
+        
+        self.data = details.data
+        
+        if len(self.data) != 0x5600:
+            raise IncorrectSize
+        
+        self.levels_start = 0x3800
+        self.sprites_start = 0x25c0
+        self.sprites_finish = 0x3600
+        
+        self.version = "BBC"
+        self.Reader = BBCReader
+        
+        self.tile_width = 16
+        self.tile_height = 32
     
-                for column in range(32):
+    def scramble(self, data):
     
-                    if offset < 5:
-                        ch = self.data[address]
-                        current = current | (ch << offset)
-                        address += 1
-                        offset += 8
+        # XOR the data with enough copies of the key to cover it in a single
+        # operation by treating both as large integers, keeping the first
+        # byte.
+        length = len(data)
+        key = (scramble_key * ((length + 255) // 256))[:length]
+        
+        d = int.from_bytes(data, "little") ^ int.from_bytes(key, "little")
+        return bytes(data[:1]) + d.to_bytes(length, "little")[1:]
     
-                    if offset >= 5:
-                        value = current & 0x1f
-                        current = current >> 5
-                        offset -= 5
-                        level[-1].append(value)
-            
-            levels.append(level)
+    def read_levels(self):
+    
+        # Unpack the rows of all 12 levels at once.
+        start = self.levels_start
+        cells = unpack_rows(self.data[start:start + (12 * 640)])
+        
+        levels = []
+        
+        for number in range(12):
+        
+            address = number * 1024
+            levels.append([list(cells[row:row + 32])
+                           for row in range(address, address + 1024, 32)])
         
         return levels
     
     def write_levels(self, levels):
     
-        data = self.data[:self.levels_start]
+        data = bytes(self.data[:self.levels_start])
         
-        for number in range(len(levels)):
+        cells = b"".join(bytes(row) for level in levels for row in level)
         
-            level = levels[number]
-            
-            for row in range(32):
-            
-                current = 0
-                offset = 0
-                
-                for column in range(32):
-                
-                    if offset < 8:
-                        current = current | (level[row][column] << offset)
-                        offset += 5
-                    
-                    if offset >= 8:
-                        data += bytes([current & 0xff])
-                        current = current >> 8
-                        offset -= 8
-        
-        self.data = data
+        self.data = data + pack_rows(cells)
     
     def read_sprites(self):
     
@@ -227,11 +242,17 @@ class Repton:
         last_file = self.uef.contents[-1]
         last_index = len(self.uef.contents) - 1
         
-        self.uef.remove_files([last_index])
+        if len(self.data) == len(last_file["data"]):
         
-        # Add the last file again with the updated level data.
-        info = (last_file["name"], last_file["load"], last_file["exec"], self.data)
-        self.uef.import_files(last_index, info)
+            # Only encode the blocks containing changed data again.
+            self.uef.patch_file(last_index, self.data)
+        
+        else:
+            self.uef.remove_files([last_index])
+            
+            # Add the last file again with the updated level data.
+            info = (last_file["name"], last_file["load"], last_file["exec"], self.data)
+            self.uef.import_files(last_index, info)
         
         try:
             self.uef.write(path, write_emulator_info = False)
@@ -241,14 +262,24 @@ class Repton:
     
     def saveSSD(self, path):
     
+        title, files = self.ssd.catalogue().read()
+        
+        if len(self.data) == files[self.file_number].length:
+        
+            # Only write the sectors containing changed data, leaving the
+            # other files and the layout of the disk unchanged.
+            try:
+                self.patchSSD(path)
+                return True
+            except (IOError, makedfs.DiskError):
+                return False
+        
         # Write the new SSD file.
         disk = makedfs.Disk()
         disk.new()
         catalogue = disk.catalogue()
         catalogue.boot_option = 3
         
-        title, files = self.ssd.catalogue().read()
-        
         # Update the level data.
         files[self.file_number].data = self.data
         
@@ -257,10 +288,26 @@ class Repton:
             file.length = len(file.data)
         
         catalogue.write(title, files)
-        disk.file.seek(0, 0)
         
         try:
-            open(path, "wb").write(disk.file.read())
+            disk.save(path)
             return True
         except IOError:
             return False
+    
+    def patchSSD(self, path):
+    
+        if self.ssd.writable and os.path.exists(path) and \
+           os.path.samefile(path, self.ssd.path):
+        
+            # Patch the original disk image in place.
+            disk = self.ssd
+        else:
+            # Copy the original disk image and patch the copy.
+            self.ssd.save(path)
+            disk = makedfs.Disk.from_path(path, writable = True)
+        
+        catalogue = disk.catalogue()
+        title, files = catalogue.read()
+        catalogue.patch_file(files[self.file_number], self.data)
+        disk.flush()
@@ -21,6 +21,7 @@ __all__ = ["sprites"]
 
 import UEFfile
 import makedfs
+from levelutils import pack_rows, unpack_rows
 
 from Repton2.sprites import Reader
 
@@ -54,71 +55,124 @@ class Repton2:
     
         if uef_or_ssd_file.endswith("uef"):
         
-            # Acorn Electron version
-            
-            self.uef = UEFfile.UEFfile(uef_or_ssd_file)
-            self.file_number = 0
-            
-            for details in self.uef.contents:
+            self.read_uef(UEFfile.UEFfile(uef_or_ssd_file))
+        
+        elif uef_or_ssd_file.endswith("ssd"):
+        
+            self.read_ssd(makedfs.Disk.from_fileobj(open(uef_or_ssd_file, "rb")))
+        
+        else:
+            raise NotFound
     
-                if details["name"].upper() == b"REPTONB":
-                    break
-                
-                self.file_number += 1
-            else:
-                raise NotFound
-            
-            self.data = details["data"]
+    @classmethod
+    def from_bytes(cls, data):
+    
+        # Identify the format of the data from its contents instead of a
+        # file name.
+        if UEFfile.is_uef(data):
+            return cls.from_uef(UEFfile.UEFfile.from_bytes(data))
+        elif makedfs.is_dfs_image(data):
+            return cls.from_disk(makedfs.Disk.from_bytes(data))
+        else:
+            raise NotFound
+    
+    @classmethod
+    def from_fileobj(cls, file_object):
+    
+        return cls.from_bytes(file_object.read())
+    
+    @classmethod
+    def from_uef(cls, uef):
+    
+        repton2 = cls.__new__(cls)
+        repton2.read_uef(uef)
+        return repton2
+    
+    @classmethod
+    def from_disk(cls, disk):
+    
+        repton2 = cls.__new__(cls)
+        repton2.read_ssd(disk)
+        return repton2
+    
+    @classmethod
+    def in_index(cls, index):
+    
+        # Identify the game from the name and length of its data file in a
+        # UEFIndex without reading the file's data.
+        for details in index.contents:
         
-            if len(self.data) != 0x4c00:
-                raise IncorrectSize
-            
-            self.screen_area_start = 0x2000
-            self.levels_start = 0x2e00
-            self.transporters_address = 0x1e50
-            self.puzzle_address = 0x1da0
-            
-            self.version = "Electron"
+            if details["name"].upper() == b"REPTONB":
+                return details["length"] == 0x4c00
         
-        elif uef_or_ssd_file.endswith("ssd"):
+        return False
+    
+    def read_uef(self, uef):
+    
+        # Acorn Electron version
         
-            # BBC Micro DFS disk version
-            
-            self.ssd = makedfs.Disk()
-            self.ssd.open(open(uef_or_ssd_file))
-            self.file_number = 0
-            
-            cat = self.ssd.catalogue()
-            title, contents = cat.read()
-            
-            for details in contents:
-                if details.name == b"D.REPB":
-                    break
-                
-                self.file_number += 1
-            else:
-                raise NotFound
-            
-            data = details.data
-            
-            if len(data) != 0x5400:
-                raise IncorrectSize
-            
-            # Unscramble the data.
-            self.data = bytes(map(lambda x: x ^ 0x66, data))
-            
-            self.screen_area_start = 0x1b00
-            self.levels_start = 0x3500
-            self.transporters_address = 0x1b40
-            self.puzzle_address = 0x1cf8
+        self.uef = uef
+        self.file_number = 0
+        
+        for details in self.uef.contents:
+    
+            if details["name"].upper() == b"REPTONB":
+                break
             
-            self.version = "BBC"
+            self.file_number += 1
+        else:
+            raise NotFound
+        
+        self.data = details["data"]
+    
+        if len(self.data) != 0x4c00:
+            raise IncorrectSize
+        
+        self.screen_area_start = 0x2000
+        self.levels_start = 0x2e00
+        self.transporters_address = 0x1e50
+        self.puzzle_address = 0x1da0
+        
+        self.version = "Electron"
+    
+    def read_ssd(self, disk):
+    
+        # BBC Micro DFS disk version
+        
+        self.ssd = disk
+        self.file_number = 0
+        
+        cat = self.ssd.catalogue()
+        title, contents = cat.read()
         
+        for details in contents:
+            if details.name == b"D.REPB":
+                break
+            
+            self.file_number += 1
         else:
             raise NotFound
+        
+        data = details.data
+        
+        if len(data) != 0x5400:
+            raise IncorrectSize
+        
+        # Unscramble the data.
+        self.data = bytes(map(lambda x: x ^ 0x66, data))
+        
+        self.screen_area_start = 0x1b00
+        self.levels_start = 0x3500
+        self.transporters_address = 0x1b40
+        self.puzzle_address = 0x1cf8
+        
+        self.version = "BBC"
     
     def read_levels(self):
     
+        # Unpack the rows of all the areas that can be defined at once.
+        cells = unpack_rows(self.data[self.levels_start:])
+        
         levels = []
         
         for number in range(16):
@@ -137,27 +191,14 @@ class Repton2:
                         level.append([offset & 0x1f]*32)
                 
                 else:
-                    address = self.levels_start + (offset * 160)
+                    address = offset * 256
                     
-                    for row in range(8):
+                    # The area must be defined in the level data.
+                    if address + 256 > len(cells):
+                        raise IncorrectSize
                     
-                        current = 0
-                        offset = 0
-                        level.append([])
-                        
-                        for column in range(32):
-            
-                            if offset < 5:
-                                ch = self.data[address]
-                                current = current | (ch << offset)
-                                address += 1
-                                offset += 8
-            
-                            if offset >= 5:
-                                value = current & 0x1f
-                                current = current >> 5
-                                offset -= 5
-                                level[-1].append(value)
+                    for row in range(address, address + 256, 32):
+                        level.append(list(cells[row:row + 32]))
             
             levels.append(level)
         
@@ -425,6 +466,7 @@ class Repton2:
         
         # Level definitions
         next = 0
+        rows = []
         
         for a in range(len(areas)):
         
@@ -441,21 +483,10 @@ class Repton2:
             next = area + 1
             start_row = (a % 4) * 8
             
-            for row in range(start_row, start_row + 8):
-            
-                current = 0
-                offset = 0
-                
-                for column in range(32):
-                
-                    if offset < 8:
-                        current = current | (level[row][column] << offset)
-                        offset += 5
-                    
-                    if offset >= 8:
-                        data += bytes([current & 0xff])
-                        current = current >> 8
-                        offset -= 8
+            for row in level[start_row:start_row + 8]:
+                rows.append(bytes(row))
+        
+        data += pack_rows(b"".join(rows))
         
         # Fill the rest of the level data with null bytes.
         data += (0x4c00 - len(data)) * b"\x00"
@@ -0,0 +1,771 @@
+#!/usr/bin/env python
+
+"""
+UEFaudio.py - Convert between the tape chunks in UEF archives and audio.
+
+Copyright (C) 2026 The ReptonMaps contributors
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import array, collections, math, re, struct, sys, wave, zlib
+
+from UEFfile import UEFfile, UEFfile_error
+
+# The amount of audio data collected before it is written to a file
+write_buffer_size = 0x40000
+
+# The amount of audio data read from a file at a time
+read_buffer_size = 0x40000
+
+# The header of a CSW file, up to and including the version number
+csw_header = b'Compressed Square Wave\032\001\001'
+
+
+class TapeRenderer:
+    """renderer = TapeRenderer(sample_rate, baud)
+
+    Convert tape chunks to audio data using frequency shift keying, where
+    a zero bit is one cycle at the baud rate and a one bit is two cycles at
+    twice that frequency. The audio for each bit and for each byte framed
+    with start and stop bits is calculated in advance, so that chunks are
+    converted by joining these pieces together.
+
+    Each bit lasts a whole number of samples, so the timing is only exact
+    when the sample rate is a multiple of four times the baud rate, as it
+    is for the default rate of 48000 Hz.
+    """
+
+    def __init__(self, sample_rate = 48000, baud = 1200):
+
+        self.sample_rate = sample_rate
+        self.baud = baud
+
+        # The length in samples of half a cycle of the carrier tone
+        half_cycle = max(1, int(round(sample_rate / (baud * 4.0))))
+
+        # A cycle of carrier tone, and a cycle at half its frequency
+        self.high_cycle = self.make_cycle(half_cycle)
+        self.low_cycle = self.make_cycle(2 * half_cycle)
+
+        # Zero and one bits
+        self.bit_templates = (self.low_cycle, self.high_cycle * 2)
+
+        # Each byte stored with its bits in order of increasing significance
+        self.bits_templates = []
+        # Each byte framed with a start bit and a stop bit
+        self.byte_templates = []
+
+        for i in range(256):
+
+            bits = self.bits(i, 8)
+            self.bits_templates.append(bits)
+            self.byte_templates.append(self.bit_templates[0] + bits +
+                                       self.bit_templates[1])
+
+    def bits(self, value, number):
+
+        return b''.join([self.bit_templates[(value >> i) & 1]
+                         for i in range(number)])
+
+    def tone(self, cycles):
+
+        return self.high_cycle * cycles
+
+    def gap(self, seconds):
+
+        return self.silence(int(round(seconds * self.sample_rate)))
+
+    def encode_bytes(self, data):
+
+        return b''.join(map(self.byte_templates.__getitem__, data))
+
+    def encode_bits(self, data, bits):
+
+        """Returns the audio for the given number of bits, read from the
+        data in order of increasing significance."""
+
+        whole, remainder = divmod(bits, 8)
+        audio = b''.join(map(self.bits_templates.__getitem__, data[:whole]))
+
+        if remainder:
+            audio += self.bits(data[whole], remainder)
+
+        return audio
+
+    def render_chunks(self, uef):
+
+        """Generates the audio for each tape chunk in the UEF file."""
+
+        for chunk_id, data in uef.chunks:
+
+            if chunk_id == 0x100:
+
+                # Implicit start/stop bit tape data block
+                yield self.encode_bytes(data)
+
+            elif chunk_id == 0x102:
+
+                # Explicit tape data block
+                if uef.major == 0 and uef.minor < 9:
+                    yield self.encode_bits(data, len(data) * 8)
+                elif len(data) > 0:
+                    yield self.encode_bits(data[1:], (len(data) - 1) * 8 - data[0])
+
+            elif chunk_id == 0x110:
+
+                # Carrier tone
+                yield self.tone(uef.str2num(2, data))
+
+            elif chunk_id == 0x111:
+
+                # Carrier tone with a dummy byte between two lengths of tone
+                yield self.tone(uef.str2num(2, data[0:2]))
+                yield self.encode_bytes(b'\xaa')
+                yield self.tone(uef.str2num(2, data[2:4]))
+
+            elif chunk_id == 0x112:
+
+                # Integer gap, measured in half cycles at the baud rate
+                yield self.gap(uef.str2num(2, data) / (2.0 * self.baud))
+
+            elif chunk_id == 0x116:
+
+                # Floating point gap, measured in seconds
+                yield self.gap(struct.unpack("<f", data[:4])[0])
+
+    def write(self, uef, filename):
+
+        """Writes the audio for the tape chunks in the UEF file to the file
+        with the specified filename or to a binary file-like object."""
+
+        out = self.open(filename)
+
+        # Collect the audio for the chunks, writing it in batches.
+        pieces = []
+        size = 0
+
+        for piece in self.render_chunks(uef):
+
+            pieces.append(piece)
+            size += len(piece)
+
+            if size >= write_buffer_size:
+                self.write_audio(out, b''.join(pieces))
+                pieces = []
+                size = 0
+
+        if pieces:
+            self.write_audio(out, b''.join(pieces))
+
+        self.close(out, filename)
+
+
+class WAVRenderer(TapeRenderer):
+    """renderer = WAVRenderer(sample_rate, baud)
+
+    Convert tape chunks to 16-bit mono PCM audio and write it in WAV files.
+    """
+
+    amplitude = 0x6000
+
+    def make_cycle(self, half_cycle):
+
+        samples = array.array('h')
+        length = 2 * half_cycle
+
+        for i in range(length):
+            samples.append(int(round(self.amplitude * math.sin(2 * math.pi * i / length))))
+
+        if sys.byteorder == 'big':
+            samples.byteswap()
+
+        return samples.tobytes()
+
+    def silence(self, samples):
+
+        return b'\x00\x00' * samples
+
+    def open(self, filename):
+
+        try:
+            out = wave.open(filename, 'wb')
+        except IOError:
+            raise UEFfile_error("Couldn't open %s for writing." % filename)
+
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(self.sample_rate)
+        return out
+
+    def write_audio(self, out, data):
+
+        out.writeframesraw(data)
+
+    def close(self, out, filename):
+
+        out.close()
+
+
+class CSWRenderer(TapeRenderer):
+    """renderer = CSWRenderer(sample_rate, baud)
+
+    Convert tape chunks to pulses stored in version 1.01 Compressed Square
+    Wave (CSW) files, where each byte of the data is the length of a pulse
+    in samples and longer pulses are stored as a zero byte followed by a
+    four byte length.
+    """
+
+    def make_cycle(self, half_cycle):
+
+        return bytes([half_cycle, half_cycle])
+
+    def silence(self, samples):
+
+        if samples == 0:
+            return b''
+
+        return b'\x00' + struct.pack("<I", samples)
+
+    def open(self, filename):
+
+        if hasattr(filename, 'write'):
+            out = filename
+        else:
+            try:
+                out = open(filename, 'wb')
+            except IOError:
+                raise UEFfile_error("Couldn't open %s for writing." % filename)
+
+        # Header, sample rate, run-length encoding, initial polarity and
+        # reserved bytes
+        out.write(csw_header + struct.pack("<HBB3x", self.sample_rate, 1, 0))
+        return out
+
+    def write_audio(self, out, data):
+
+        out.write(data)
+
+    def close(self, out, filename):
+
+        if out is not filename:
+            out.close()
+
+
+def sample_value(i, signed):
+
+    """Returns the value of a sample whose most significant byte is i."""
+
+    if signed:
+        return i - 256 * (i >> 7)
+    else:
+        return i - 128
+
+
+def make_sign_table(signed, quiet):
+
+    """Returns a table for use with bytes.translate that maps the most
+    significant byte of each sample to b'+' or b'-' for its sign, or to b'0'
+    if its magnitude is less than quiet, so that noise is ignored."""
+
+    table = bytearray()
+
+    for i in range(256):
+
+        value = sample_value(i, signed)
+
+        if -quiet <= value < quiet:
+            table.append(ord('0'))
+        elif value > 0:
+            table.append(ord('+'))
+        else:
+            table.append(ord('-'))
+
+    return bytes(table)
+
+
+def make_magnitude_table(signed):
+
+    """Returns a table for use with bytes.translate that maps the most
+    significant byte of each sample to its magnitude."""
+
+    return bytes([min(abs(sample_value(i, signed)), 255) for i in range(256)])
+
+
+# Tables for signed samples and for unsigned 8-bit samples
+magnitude_tables = (make_magnitude_table(True), make_magnitude_table(False))
+
+# Runs of samples with the same sign, where quiet samples are included in
+# the run before them
+run_pattern = re.compile(b'\\+[+0]*|-[-0]*|0+')
+
+
+class PulseSymbols(dict):
+    """symbols = PulseSymbols(short, unit)
+
+    Map the lengths of pulses, measured in samples, to symbols: b'S' for a
+    short pulse, which is half a cycle of carrier tone, b'L' for a long
+    pulse of twice that length, and a number of b'G' symbols for a gap,
+    one for each unit of time given in samples. Symbols are calculated for
+    each length when it is first encountered.
+    """
+
+    def __init__(self, short, unit):
+
+        dict.__init__(self)
+        self.short = short
+        self.unit = unit
+
+    def __missing__(self, length):
+
+        if length < 1.5 * self.short:
+            symbol = b'S'
+        elif length < 4 * self.short:
+            symbol = b'L'
+        else:
+            symbol = b'G' * max(1, int(round(length / self.unit)))
+
+        self[length] = symbol
+        return symbol
+
+
+class TapeDecoder:
+    """decoder = TapeDecoder(baud)
+
+    Convert the pulses in a tape recording back to tape chunks. Each pulse,
+    or half cycle, is converted to a symbol for a short pulse, a long pulse
+    or a gap, and the symbols are matched against patterns for carrier tone
+    and bytes framed with start and stop bits, so that only the resulting
+    bytes, tones and gaps are handled individually.
+
+    The length of a short pulse is measured from the carrier tone in each
+    part of the recording, so that variations in tape speed are followed.
+    The recording is read in pieces, so the amount of memory used does not
+    depend on its length.
+    """
+
+    # A framed byte, with a start bit, eight data bits and a stop bit whose
+    # last pulse may be merged with a following gap
+    byte_pattern = re.compile(b'LL((?:LL|SSSS){8})SSS(?:S|(?=G)|\\Z)')
+    tone_pattern = re.compile(b'S+')
+    gap_pattern = re.compile(b'G+')
+
+    # The largest number of symbols in a framed byte
+    byte_symbols = 38
+
+    # The shortest run of short pulses treated as tone rather than as extra
+    # stop bits between bytes
+    min_tone = 16
+
+    # The number of short pulses needed to measure the carrier tone
+    min_carrier = 256
+
+    def __init__(self, baud = 1200):
+
+        self.baud = baud
+        self.sample_rate = None
+
+        # The symbols for the data bits in each byte
+        self.byte_values = {}
+
+        for i in range(256):
+
+            bits = b''.join([(b'LL', b'SSSS')[(i >> j) & 1] for j in range(8)])
+            self.byte_values[bits] = i
+
+    def detect_carrier(self, lengths):
+
+        """Measures the length of the pulses in any carrier tone found in the
+        list of pulse lengths given, updating the symbols used for pulses."""
+
+        nominal = self.sample_rate / (self.baud * 4.0)
+        unit = self.sample_rate / (self.baud * 2.0)
+
+        total = 0
+        number = 0
+
+        for length, count in collections.Counter(lengths).items():
+
+            if 0.6 * nominal <= length <= 1.4 * nominal:
+                total += length * count
+                number += count
+
+        if number >= self.min_carrier:
+            short = total / float(number)
+        elif self.symbols is None:
+            short = nominal
+        else:
+            return
+
+        # Only discard the symbols calculated so far for a significant change
+        if self.symbols is None or abs(short - self.symbols.short) > 0.02 * nominal:
+            self.symbols = PulseSymbols(short, unit)
+
+    def decode_symbols(self, symbols, final):
+
+        """Decodes the bytes, tones and gaps in the symbols given, returning
+        any symbols at the end that cannot be decoded until more are read.
+        If final is True then all the symbols are decoded."""
+
+        pos = 0
+        end = len(symbols)
+
+        while pos < end:
+
+            symbol = symbols[pos]
+
+            if symbol == 0x4c:      # L
+
+                match = self.byte_pattern.match(symbols, pos)
+
+                if match:
+                    self.add_byte(self.byte_values[match.group(1)])
+                    pos = match.end()
+                elif end - pos < self.byte_symbols and not final:
+                    break
+                else:
+                    # Skip symbols that are not part of a byte
+                    pos = pos + 1
+
+            elif symbol == 0x53:    # S
+
+                match = self.tone_pattern.match(symbols, pos)
+                length = match.end() - pos
+
+                if length < self.min_tone:
+                    # Wait for the rest of a tone that may continue in
+                    # the symbols that have not been read yet
+                    if match.end() == end and not final:
+                        break
+                else:
+                    self.add_tone(length)
+
+                pos = match.end()
+
+            else:
+                match = self.gap_pattern.match(symbols, pos)
+                self.add_gap(match.end() - pos)
+                pos = match.end()
+
+        return symbols[pos:]
+
+    def add_byte(self, value):
+
+        self.flush_tone()
+        self.flush_gap()
+        self.block.append(value)
+
+    def add_tone(self, half_cycles):
+
+        self.flush_block()
+        self.flush_gap()
+        self.tone = self.tone + half_cycles
+
+    def add_gap(self, units):
+
+        self.flush_block()
+        self.flush_tone()
+        self.gap = self.gap + units
+
+    def flush_block(self):
+
+        if self.block:
+            self.chunks.append((0x100, bytes(self.block)))
+            self.block = bytearray()
+
+    def flush_tone(self):
+
+        cycles = self.tone // 2
+        self.tone = 0
+
+        if cycles == 0:
+            return
+
+        chunks = self.chunks
+
+        # A dummy byte between two tones is stored in a single chunk
+        if len(chunks) >= 2 and chunks[-1] == (0x100, b'\xaa') and \
+           chunks[-2][0] == 0x110 and len(chunks[-2][1]) == 2:
+
+            before = chunks[-2][1]
+            after = min(cycles, 0xffff)
+            chunks[-2:] = [(0x111, before + self.uef.number(2, after))]
+            cycles = cycles - after
+
+        while cycles > 0:
+            length = min(cycles, 0xffff)
+            chunks.append((0x110, self.uef.number(2, length)))
+            cycles = cycles - length
+
+    def flush_gap(self):
+
+        units = self.gap
+        self.gap = 0
+
+        while units > 0:
+            length = min(units, 0xffff)
+            self.chunks.append((0x112, self.uef.number(2, length)))
+            units = units - length
+
+    def read(self, filename):
+
+        """Returns a UEFfile instance containing the tape chunks decoded from
+        the recording in the file with the specified filename or in a binary
+        file-like object."""
+
+        self.uef = UEFfile()
+        self.chunks = self.uef.chunks
+        self.block = bytearray()
+        self.tone = 0
+        self.gap = 0
+        self.symbols = None
+
+        symbols = b''
+
+        for lengths in self.pulses(filename):
+
+            self.detect_carrier(lengths)
+            symbols = symbols + b''.join(map(self.symbols.__getitem__, lengths))
+            symbols = self.decode_symbols(symbols, False)
+
+        self.decode_symbols(symbols, True)
+
+        self.flush_block()
+        self.flush_tone()
+        self.flush_gap()
+
+        self.uef.read_contents()
+        return self.uef
+
+
+class WAVDecoder(TapeDecoder):
+    """decoder = WAVDecoder(baud)
+
+    Convert PCM audio in WAV files to tape chunks, using the first channel
+    of the recording. Pulses are found by translating the most significant
+    byte of each sample to its sign and measuring the runs of samples with
+    the same sign. Samples quieter than a quarter of the recent signal level
+    do not change the sign, so that noise in gaps and near zero crossings is
+    ignored.
+    """
+
+    def sign_table(self, signed, quiet):
+
+        key = (signed, quiet)
+
+        if key not in self.sign_tables:
+            self.sign_tables[key] = make_sign_table(signed, quiet)
+
+        return self.sign_tables[key]
+
+    def pulses(self, filename):
+
+        """Generates lists of the lengths of the pulses in the recording."""
+
+        try:
+            w = wave.open(filename, 'rb')
+        except (IOError, EOFError, wave.Error):
+            raise UEFfile_error("Couldn't read %s as a WAV file." % filename)
+
+        self.sample_rate = w.getframerate()
+        width = w.getsampwidth()
+        stride = width * w.getnchannels()
+
+        signed = width > 1
+        self.sign_tables = {}
+        level = 0
+
+        # The length and sign of the last run of samples, which may continue
+        # in the next part of the recording
+        carry = 0
+        carry_sign = None
+
+        while True:
+
+            data = w.readframes(read_buffer_size)
+            if not data:
+                break
+
+            samples = data[width - 1::stride]
+
+            # Follow the signal level, allowing it to fall slowly in gaps
+            level = max(max(samples.translate(magnitude_tables[width == 1])),
+                        level // 2)
+            table = self.sign_table(signed, max(1, level // 4))
+
+            runs = run_pattern.findall(samples.translate(table))
+            lengths = list(map(len, runs))
+
+            if carry:
+                if runs[0][:1] in (carry_sign, b'0'):
+                    lengths[0] = lengths[0] + carry
+                else:
+                    lengths.insert(0, carry)
+
+            carry_sign = runs[-1][:1]
+            carry = lengths.pop()
+
+            yield lengths
+
+        w.close()
+
+        if carry:
+            yield [carry]
+
+
+class CSWDecoder(TapeDecoder):
+    """decoder = CSWDecoder(baud)
+
+    Convert the pulses stored in version 1 and 2 Compressed Square Wave
+    (CSW) files to tape chunks.
+    """
+
+    long_pulse = struct.Struct("<I")
+
+    def pulses(self, filename):
+
+        """Generates lists of the lengths of the pulses in the recording."""
+
+        if hasattr(filename, 'read'):
+            f = filename
+        else:
+            try:
+                f = open(filename, 'rb')
+            except IOError:
+                raise UEFfile_error('The input file, '+filename+' could not be found.')
+
+        header = f.read(0x20)
+
+        if len(header) < 0x20 or header[:23] != csw_header[:23]:
+            raise UEFfile_error("Couldn't read %s as a CSW file." % filename)
+
+        if header[23] == 1:
+            self.sample_rate, compression = struct.unpack_from("<HB", header, 25)
+        else:
+            # Version 2 headers contain the number of pulses, the name of
+            # the encoding application and an extension
+            header = header + f.read(0x14)
+            self.sample_rate, compression, extension = \
+                struct.unpack_from("<I4xBxB", header, 25)
+            f.read(extension)
+
+        if compression == 1:
+            decompressor = None
+        elif compression == 2:
+            decompressor = zlib.decompressobj()
+        else:
+            raise UEFfile_error("Unsupported compression type in %s." % filename)
+
+        pending = b''
+
+        while True:
+
+            data = f.read(read_buffer_size)
+
+            if decompressor:
+                if data:
+                    data = decompressor.decompress(data)
+                else:
+                    data = decompressor.flush()
+
+            if not data:
+                break
+
+            data = pending + data
+            pending = b''
+            lengths = []
+            pos = 0
+
+            # Each non-zero byte is a pulse length; zero is followed by a
+            # four byte length
+            while True:
+
+                i = data.find(b'\x00', pos)
+
+                if i == -1:
+                    lengths.extend(data[pos:])
+                    break
+
+                lengths.extend(data[pos:i])
+
+                if i + 5 > len(data):
+                    pending = data[i:]
+                    break
+
+                lengths.append(self.long_pulse.unpack_from(data, i + 1)[0])
+                pos = i + 5
+
+            yield lengths
+
+        if f is not filename:
+            f.close()
+
+
+if __name__ == "__main__":
+
+    if not 3 <= len(sys.argv) <= 4:
+
+        sys.stderr.write("Usage: %s <UEF file> <WAV or CSW file> [sample rate]\n" % sys.argv[0])
+        sys.stderr.write("       %s <WAV or CSW file> <UEF file>\n" % sys.argv[0])
+        sys.exit(1)
+
+    audio_suffixes = (".wav", ".csw")
+
+    if sys.argv[1].lower().endswith(audio_suffixes):
+
+        # Decode a recording and write the tape chunks to a UEF file
+        if len(sys.argv) != 3:
+            sys.stderr.write("The sample rate is read from the recording.\n")
+            sys.exit(1)
+
+        audio_file, uef_file = sys.argv[1:3]
+
+        if audio_file.lower().endswith(".csw"):
+            decoder = CSWDecoder()
+        else:
+            decoder = WAVDecoder()
+
+        try:
+            decoder.read(audio_file).write(uef_file)
+        except UEFfile_error as exception:
+            sys.stderr.write("%s\n" % exception)
+            sys.exit(1)
+
+        sys.exit()
+
+    uef_file, audio_file = sys.argv[1:3]
+
+    try:
+        sample_rate = 48000
+        if len(sys.argv) == 4:
+            sample_rate = int(sys.argv[3])
+            if not 0 < sample_rate < 0x10000:
+                raise ValueError
+
+    except ValueError:
+        sys.stderr.write("The sample rate must be an integer from 1 to 65535.\n")
+        sys.exit(1)
+
+    if audio_file.lower().endswith(".csw"):
+        renderer = CSWRenderer(sample_rate)
+    else:
+        renderer = WAVRenderer(sample_rate)
+
+    try:
+        renderer.write(UEFfile(uef_file, lazy = True), audio_file)
+    except UEFfile_error as exception:
+        sys.stderr.write("%s\n" % exception)
+        sys.exit(1)
+
+    sys.exit()
@@ -20,6 +20,9 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import sys, string, os, gzip, types
+import array, binascii, io, mmap, shutil, struct, tempfile, zlib
+
+from records import Record, compile_struct
 
 class UEFfile_error(Exception):
 
@@ -36,8 +39,204 @@ else:
 
 version = '0.21'
 date = '2013-03-03'
-    
-    
+
+# The headers at the start of UEF files and gzip-compressed files
+uef_header = b'UEF File!\000'
+gzip_header = b'\037\213'
+
+
+def is_uef(data):
+    """Return True if the data contains a UEF file, which may be compressed
+    using gzip, judging by the header at the start of the data."""
+
+    if bytes(data[:10]) == uef_header:
+        return True
+
+    if bytes(data[:2]) == gzip_header:
+
+        try:
+            return gzip.GzipFile(fileobj = io.BytesIO(data)).read(10) == uef_header
+        except (OSError, EOFError, zlib.error):
+            return False
+
+    return False
+
+
+def make_crc_table():
+    """Return a list of 256 values used to update the tape CRC a byte at
+    a time. The CRC is the CCITT polynomial (0x1021) with the high byte of
+    the result stored first."""
+
+    table = []
+
+    for i in range(256):
+
+        n = i << 8
+
+        for j in range(8):
+
+            if n & 0x8000:
+                n = ((n << 1) ^ 0x1021) & 0xffff
+            else:
+                n = (n << 1) & 0xffff
+
+        table.append(n)
+
+    return table
+
+crc_table = make_crc_table()
+
+
+def make_unframe_tables():
+    """Return a list of pairs of translation tables used to extract the low
+    and high parts of each byte in a group of four ten bit frames stored in
+    five bytes."""
+
+    tables = []
+
+    for shift in (1, 3, 5, 7):
+
+        low = bytes([i >> shift for i in range(256)])
+        high = bytes([(i << (8 - shift)) & 0xff for i in range(256)])
+        tables.append((low, high))
+
+    return tables
+
+unframe_tables = make_unframe_tables()
+
+# The ID and length of each chunk
+chunk_header = compile_struct("<HI")
+
+# The amount of chunk data collected before it is written to a file
+write_buffer_size = 0x10000
+
+# The fields in a block header following the file name: the load and
+# execution addresses, block number, block length, block flag and the
+# address of the next file, with the top bit of the flag marking the last
+# block of a file
+block_header = Record(
+    (("load", 0, 4), ("exec", 4, 4), ("number", 8, 2), ("length", 10, 2),
+     ("flag", 12, 1), ("next", 13, 4)),
+    (("last", "flag", 0x80, -7),))
+block_crc = compile_struct("<H")
+
+# The length of the longest block header: the alignment character, a name of
+# up to 10 characters and its terminator, the header fields and the CRC
+max_header_length = 12 + block_header.size + block_crc.size
+
+# Tones before the first block of a file and before each subsequent block
+first_block_tone = b'\xdc\x05'
+block_tone = b'\x58\x02'
+
+# The shortest tone left between the blocks of a file by compaction (0.1s)
+min_block_tone = b'\xf0\x00'
+
+
+class ChunkIndex:
+    """chunks = ChunkIndex(buffer, offset)
+
+    A sequence of (chunk ID, data) tuples backed by a buffer, such as a
+    memory-mapped file, containing the chunks of a UEF file. Only the chunk
+    headers are read when the index is created; the data for each chunk is
+    returned as a memoryview of the buffer when the chunk is requested.
+    The offset parameter gives the position of the first chunk header.
+    """
+
+    header = chunk_header
+
+    def __init__(self, buffer, offset = 12):
+
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+
+        # Chunk IDs and the offsets and lengths of their data
+        self.ids = array.array('H')
+        self.offsets = array.array('Q')
+        self.lengths = array.array('Q')
+
+        end = len(buffer)
+
+        while offset + self.header.size <= end:
+
+            chunk_id, length = self.header.unpack_from(buffer, offset)
+            offset = offset + self.header.size
+
+            self.ids.append(chunk_id)
+            self.offsets.append(offset)
+            # Truncated chunks only contain the data that is present
+            self.lengths.append(min(length, end - offset))
+
+            offset = offset + length
+
+    def __len__(self):
+
+        return len(self.ids)
+
+    def __getitem__(self, i):
+
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self.ids)))]
+
+        if i < 0:
+            i = i + len(self.ids)
+
+        if not 0 <= i < len(self.ids):
+            raise IndexError("chunk index out of range")
+
+        offset = self.offsets[i]
+        return (self.ids[i], self.view[offset:offset + self.lengths[i]])
+
+    def __delitem__(self, i):
+
+        del self.ids[i]
+        del self.offsets[i]
+        del self.lengths[i]
+
+    def __iter__(self):
+
+        for i in range(len(self.ids)):
+            yield self[i]
+
+    def remove(self, positions):
+        """Remove the chunks at the positions in the sorted list given."""
+
+        for name in ('ids', 'offsets', 'lengths'):
+
+            old = getattr(self, name)
+            new = array.array(old.typecode)
+            start = 0
+
+            for position in positions:
+                new.extend(old[start:position])
+                start = position + 1
+
+            new.extend(old[start:])
+            setattr(self, name, new)
+
+
+class LazyFileDetails(dict):
+    """details = LazyFileDetails(uef, details)
+
+    A dictionary describing a file in the contents list of a UEFfile that
+    was opened lazily. The 'data' entry is only created, by decoding and
+    joining the data in the file's blocks, when it is first used, so it is
+    not returned by methods such as get and items until then.
+    """
+
+    def __init__(self, uef, details):
+
+        dict.__init__(self, details)
+        self.uef = uef
+
+    def __missing__(self, key):
+
+        if key != 'data':
+            raise KeyError(key)
+
+        data = self['data'] = self.uef.read_file_data(self)
+        return data
+
+
 class UEFfile:
     """instance = UEFfile(filename, creator)
 
@@ -48,8 +247,19 @@ class UEFfile:
 
     """
 
-    def __init__(self, filename = None, creator = 'UEFfile '+version):
-        """Create a new instance of the UEFfile class."""
+    def __init__(self, filename = None, creator = 'UEFfile '+version,
+                 lazy = False):
+        """Create a new instance of the UEFfile class.
+
+        If lazy is True, the file is memory-mapped (after decompression to a
+        temporary file, if necessary) and only the chunk headers are read.
+        The chunks list is then a ChunkIndex whose chunk data is returned
+        as memoryview objects. Only the block headers are read to find the
+        files in the contents list, and the data of each file is read when
+        it is first used. The file must not be modified while the instance
+        is in use, except by writing the instance back to it with the write
+        method.
+        """
 
         if filename == None:
 
@@ -75,6 +285,17 @@ class UEFfile:
 
             # List of files
             self.contents = []
+        elif lazy:
+
+            # Map the file and index the chunks it contains
+            self.chunks = self.map_chunks(filename)
+
+            # UEF file information (placed in "creator", "target_machine",
+            # "keyboard_layout", "emulator" and "features" attributes).
+            self.read_uef_details()
+
+            # Read file contents (placed in the list attribute "contents").
+            self.read_contents()
         else:
             # Read in the chunks from the file
 
@@ -136,72 +357,206 @@ class UEFfile:
             self.read_contents()
 
 
+    def map_chunks(self, filename):
+        """Memory-map the UEF file with the specified filename and return a
+        ChunkIndex describing the chunks it contains."""
+
+        # Open the input file
+        try:
+            in_f = open(filename, 'rb')
+        except IOError:
+            raise UEFfile_error('The input file, '+filename+' could not be found.')
+
+        # Is it gzipped?
+        if in_f.read(10) != uef_header:
+
+            in_f.close()
+
+            # Decompress the file once into a temporary file and map that
+            in_f = tempfile.TemporaryFile()
+
+            try:
+                gz_f = gzip.open(filename, 'rb')
+                shutil.copyfileobj(gz_f, in_f)
+                gz_f.close()
+                in_f.flush()
+            except:
+                in_f.close()
+                raise UEFfile_error('The input file, '+filename+' could not be read.')
+
+        try:
+            buffer = mmap.mmap(in_f.fileno(), 0, access = mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            buffer = b''
+
+        # The mapping remains valid after the file is closed
+        in_f.close()
+
+        return self.index_chunks(buffer, 'The input file, '+filename)
+
+
+    def index_chunks(self, buffer, description = 'The data'):
+        """Check the header in the buffer containing an uncompressed UEF file,
+        read the version number and return a ChunkIndex describing the
+        chunks in the buffer."""
+
+        if len(buffer) < 12 or bytes(buffer[:10]) != uef_header:
+            raise UEFfile_error(description+' is not a UEF file.')
+
+        # Read version number of the file format
+        self.minor = buffer[10]
+        self.major = buffer[11]
+
+        return ChunkIndex(buffer, 12)
+
+
+    @classmethod
+    def from_bytes(cls, data):
+        """instance = UEFfile.from_bytes(data)
+
+        Create an instance of a UEF container using the bytes of a UEF file,
+        which may be compressed using gzip. As with files opened lazily, the
+        chunk data refers to the bytes supplied without copying them.
+        """
+
+        if bytes(data[:2]) == gzip_header:
+
+            try:
+                data = gzip.decompress(data)
+            except (OSError, EOFError, zlib.error):
+                raise UEFfile_error('The data could not be decompressed.')
+
+        uef = cls()
+        uef.chunks = uef.index_chunks(data)
+
+        # UEF file information (placed in "creator", "target_machine",
+        # "keyboard_layout", "emulator" and "features" attributes).
+        uef.read_uef_details()
+
+        # Read file contents (placed in the list attribute "contents").
+        uef.read_contents()
+
+        return uef
+
+
+    @classmethod
+    def from_fileobj(cls, file_object):
+        """instance = UEFfile.from_fileobj(file_object)
+
+        Create an instance of a UEF container by reading a UEF file, which
+        may be compressed using gzip, from a binary file-like object.
+        """
+
+        return cls.from_bytes(file_object.read())
+
+
     def write(self, filename, write_creator_info = True,
-              write_machine_info = True, write_emulator_info = True):
+              write_machine_info = True, write_emulator_info = True,
+              compression = 9):
         """
         Write a UEF file containing all the information stored in an
-        instance of UEFfile to the file with the specified filename.
+        instance of UEFfile to the file with the specified filename, or
+        to a binary file-like object. File objects are not closed after
+        writing.
 
         By default, information about the file's creator, target machine and
         emulator is written to the file. These can be omitted by calling this
         method with individual arguments set to False.
+
+        The file is compressed using gzip at the compression level given,
+        from 1 (fastest) to 9 (smallest). If compression is None then the
+        file is written uncompressed.
+
+        An existing file with the specified filename is replaced by a new
+        file written alongside it, so an instance may be written back to a
+        file that it has memory-mapped.
         """
 
+        # The path of an existing file to be replaced
+        path = None
+
         # Open the UEF file for writing
+        if hasattr(filename, 'write'):
+            out_f = filename
+        else:
+            try:
+                if os.path.exists(filename):
+                    # Truncating a mapped file while the chunks refer to it
+                    # would invalidate them, so write a temporary file in
+                    # the same directory to replace it.
+                    path = os.path.realpath(filename)
+                    out_f = tempfile.NamedTemporaryFile(
+                        dir = os.path.dirname(path),
+                        prefix = '.' + os.path.basename(path), delete = False)
+                else:
+                    out_f = open(filename, 'wb')
+            except IOError:
+                raise UEFfile_error("Couldn't open %s for writing." % filename)
+
         try:
-            uef = gzip.open(filename, 'wb')
-        except IOError:
-            raise UEFfile_error("Couldn't open %s for writing." % filename)
-    
-        # Write the UEF file header
-        self.write_uef_header(uef)
+            if compression == None:
+                uef = out_f
+            else:
+                uef = gzip.GzipFile(mode = 'wb', compresslevel = compression,
+                                    fileobj = out_f)
 
-        if write_creator_info:
-            # Write the UEF creator chunk to the file
-            self.write_uef_creator(uef)
+            # Write the UEF file header
+            self.write_uef_header(uef)
 
-        if write_machine_info:
-            # Write the machine information
-            self.write_machine_info(uef)
+            if write_creator_info:
+                # Write the UEF creator chunk to the file
+                self.write_uef_creator(uef)
 
-        if write_emulator_info:
-            # Write the emulator information
-            self.write_emulator_info(uef)
-    
-        # Write the chunks to the file
-        self.write_chunks(uef)
-    
-        # Close the file
-        uef.close()
+            if write_machine_info:
+                # Write the machine information
+                self.write_machine_info(uef)
 
+            if write_emulator_info:
+                # Write the emulator information
+                self.write_emulator_info(uef)
 
-    def number(self, size, n):
-        """Convert a number to a little endian string of bytes for writing to a binary file."""
+            # Write the chunks to the file
+            self.write_chunks(uef)
 
-        # Little endian writing
+            # Finish the compressed stream
+            if uef is not out_f:
+                uef.close()
+
+            if path != None:
+
+                # Replace the existing file, keeping its permissions
+                out_f.close()
+                shutil.copymode(path, out_f.name)
+                os.replace(out_f.name, path)
+                path = None
+
+        except IOError:
+            raise UEFfile_error("Couldn't write to %s." % filename)
+
+        finally:
+            # Close the file if it was opened here
+            if out_f is not filename:
+                out_f.close()
 
-        s = b""
+            # Remove a temporary file that did not replace the existing file
+            if path != None:
+                os.remove(out_f.name)
 
-        while size > 0:
-            i = n % 256
-            s = s + bytes([i])
-            n = n >> 8
-            size = size - 1
 
-        return s
+    def number(self, size, n):
+        """Convert a number to a little endian string of bytes for writing to a binary file."""
+
+        # Little endian writing
+        return (n & ((1 << (size * 8)) - 1)).to_bytes(size, "little")
 
 
     def str2num(self, size, s):
         """Convert a string of ASCII characters to an integer."""
 
-        i = 0
-        n = 0
-        while i < size:
+        if len(s) < size:
+            raise IndexError("Too few bytes for a %i byte number." % size)
 
-            n = n | (s[i] << (i*8))
-            i = i + 1
-
-        return n
+        return int.from_bytes(s[:size], "little")
 
                 
     def hex2num(self, s):
@@ -242,124 +597,180 @@ class UEFfile:
 
 
     def crc(self, s):
+        """Return the tape CRC of the bytes in s. The high byte of the CRC
+        is held in the low byte of the value returned, matching the order
+        in which the bytes are stored on tape."""
 
-        high = 0
-        low = 0
+        try:
+            # The CRC is the same as the one calculated by crc_hqx for
+            # bytes-like objects
+            n = binascii.crc_hqx(s, 0)
 
-        for i in s:
+        except TypeError:
 
-            high = high ^ i
+            n = 0
+            table = crc_table
 
-            for j in range(0,8):
+            for i in s:
+                n = ((n << 8) & 0xff00) ^ table[(n >> 8) ^ i]
 
-                a, carry = self.rol(high, 0)
+        return (n >> 8) | ((n & 0xff) << 8)
 
-                if carry == 1:
-                    high = high ^ 8
-                    low = low ^ 16
+    # CRC calculation routines (end)
 
-                low, carry = self.rol(low, carry)
-                high, carry = self.rol(high, carry)
+    def chunk_ids(self, start = 0, end = None):
+        """Return a sequence containing the ID of each chunk in the list of
+        chunks from the start position up to, but not including, the end
+        position."""
 
-        return high | (low << 8)
+        if end == None:
+            end = len(self.chunks)
+
+        if isinstance(self.chunks, ChunkIndex):
+            return self.chunks.ids[start:end]
+        else:
+            return [self.chunks[i][0] for i in range(start, end)]
 
-    # CRC calculation routines (end)
 
     def read_contents(self):
         """Find the positions of files in the list of chunks"""
-        
+
         # List of files
-        self.contents = []
-        
-        current_file = {}
-        
-        position = 0
-        
-        while 1:
-        
-            position = self.find_next_block(position)
-        
-            if position == None:
-        
-                # No more blocks, so store the details of the last file in
-                # the contents list
-                if current_file != {}:
-                    self.contents.append(current_file)
-                break
-        
+        self.contents = self.find_files(0, len(self.chunks))
+
+        # We now have a contents list which tells us
+        # 1) the names of files in the archive
+        # 2) the load and execution addresses of them
+        # 3) the number of blocks they contain
+        # 4) their data, and from this their length
+        # 5) their start position (chunk number) in the archive
+
+
+    def find_files(self, start, end):
+        """Return a list containing the details of the files whose blocks
+        are found in the list of chunks between the start position and the
+        end position, in the form used for the contents list."""
+
+        # Index the positions of the blocks in the list of chunks, recording
+        # the position of the last chunk before each of them that is not a
+        # block, since this is where a file starting with the block begins
+        blocks = []
+        file_start = start
+
+        for position, chunk_id in enumerate(self.chunk_ids(start, end), start):
+
+            if chunk_id == 0x100 or chunk_id == 0x102:
+                blocks.append((position, file_start))
             else:
-        
-                # Read the block information
-                name, load, exec_addr, data, block_number, last = self.read_block(self.chunks[position])
-        
-                if current_file == {}:
-        
-                    # No current file, so store details
-                    current_file = {'name': name, 'load': load, 'exec': exec_addr, 'blocks': block_number, 'data': data}
-        
-                    # Locate the first non-block chunk before the block
-                    # and store the position of the file
-                    current_file['position'] = self.find_file_start(position)
-                    # This may also be the position of the last chunk related to
-                    # this file in the archive
-                    current_file['last position'] = position
+                file_start = position
+
+        files = []
+        current_file = None
+
+        # For files opened lazily, only the block headers are read and the
+        # data of each file is read when it is first used
+        lazy = isinstance(self.chunks, ChunkIndex)
+        pieces = None
+
+        for position, file_start in blocks:
+
+            chunk = self.chunks[position]
+
+            # Ignore chunks that are too short to be blocks
+            if len(chunk[1]) <= 1:
+                continue
+
+            # Read the block information
+            if lazy:
+                name, load, exec_addr, block_number, last = self.read_block_header(chunk)
+            else:
+                name, load, exec_addr, data, block_number, last = self.read_block(chunk)
+
+            if current_file == None or block_number == 0:
+
+                # New file, so store the previous one in the list of files
+                if current_file != None:
+                    files.append(self.join_blocks(current_file, pieces))
+
+                # Store details of this new file, which starts at the first
+                # non-block chunk before the block
+                current_file = {'name': name, 'load': load, 'exec': exec_addr,
+                                'blocks': block_number, 'position': file_start,
+                                'last position': position}
+
+                if lazy:
+                    current_file = LazyFileDetails(self, current_file)
                 else:
-        
-                    # Current file exists
-                    if block_number == 0:
-        
-                        # New file, so write the previous one to the
-                        # contents list, but before doing so, find the next
-                        # non-block chunk and mark that as the last chunk in
-                        # the file
-        
-                        if current_file != {}:
-                            self.contents.append(current_file)
-        
-                        # Store details of this new file
-                        current_file = {'name': name, 'load': load, 'exec': exec_addr, 'blocks': block_number, 'data': data}
-        
-                        # Locate the first non-block chunk before the block
-                        # and store the position of the file
-                        current_file['position'] = self.find_file_start(position)
-                        # This may also be the position of the last chunk related to
-                        # this file in the archive
-                        current_file['last position'] = position
-                    else:
-                        # Not a new file, so update the number of
-                        # blocks and append the block data to the
-                        # data entry
-                        current_file['blocks'] = block_number
-                        current_file['data'] = current_file['data'] + data
-        
-                        # Update the last position information to mark the end of the file
-                        current_file['last position'] = position
-        
-            # Increase the position
-            position = position + 1
+                    pieces = [data]
+            else:
+                # Not a new file, so update the number of blocks and the
+                # last position information to mark the end of the file
+                current_file['blocks'] = block_number
+                current_file['last position'] = position
+
+                if not lazy:
+                    pieces.append(data)
+
+        # No more blocks, so store the details of the last file in the
+        # list of files
+        if current_file != None:
+            files.append(self.join_blocks(current_file, pieces))
+
+        return files
 
-            # We now have a contents list which tells us
-            # 1) the names of files in the archive
-            # 2) the load and execution addresses of them
-            # 3) the number of blocks they contain
-            # 4) their data, and from this their length
-            # 5) their start position (chunk number) in the archive
+
+    def join_blocks(self, details, pieces):
+        """Join the data from the blocks of a file, store it in the file's
+        details and return them. If pieces is None then the data is left to
+        be read when it is first used."""
+
+        if pieces != None:
+            details['data'] = b''.join(pieces)
+
+        return details
+
+
+    def read_file_data(self, details):
+        """Decode and join the data in the blocks of the file described by
+        the details given, which refer to the current list of chunks."""
+
+        pieces = []
+
+        for position in range(details['position'], details['last position'] + 1):
+
+            chunk = self.chunks[position]
+
+            if chunk[0] in (0x100, 0x102) and len(chunk[1]) > 1:
+                pieces.append(self.read_block(chunk)[3])
+
+        return b''.join(pieces)
+
+
+    def move_contents(self, position, offset):
+        """Add the offset to the chunk positions in the contents list that
+        refer to chunks at or after the position given."""
+
+        for details in self.contents:
+
+            if details['position'] >= position:
+                details['position'] = details['position'] + offset
+            if details['last position'] >= position:
+                details['last position'] = details['last position'] + offset
 
 
     def chunk(self, f, n, data):
         """Write a chunk to the file specified by the open file object, chunk number and data supplied."""
 
-        # Chunk ID
-        f.write(self.number(2, n))
-        # Chunk length
-        f.write(self.number(4, len(data)))
+        # Chunk ID and length
+        f.write(chunk_header.pack(n, len(data)))
         # Data
         f.write(data)
 
 
-    def read_block(self, chunk):
-        """Read a data block from a tape chunk and return the program name, load and execution addresses,
-        block data, block number and whether the block is supposedly the last in the file."""
+    def decode_block(self, chunk, length = None):
+        """Return the bytes of the data block held in a tape chunk, including
+        the block header and CRCs. If a length is given then only that many
+        bytes at the start of a block held in a bit stream are decoded."""
 
         # Chunk number and data
         chunk_id = chunk[0]
@@ -379,125 +790,198 @@ class UEFfile:
                 # excess bits to be ignored at the end of the stream is
                 # set to zero implicitly
                 ignore = 0
-                bit_ptr = 0
+                start = 0
             else:
                 # For later versions, the number of excess bits is
                 # specified in the first byte of the stream
                 ignore = data[0]
-                bit_ptr = 8
+                start = 1
+
+            # Each byte is stored in ten bits with a start and stop bit, so
+            # only complete ten bit frames are read
+            frames = ((len(data) - start) * 8 - ignore) // 10
+
+            if length != None:
+                frames = min(frames, length)
 
             # Convert the data to the implicit format
-            block = []
-            write_ptr = 0
+            block = self.unframe_bits(data[start:], frames)
 
-            after_end = (len(data)*8) - ignore
-            if after_end % 10 != 0:
+        return block
 
-                # Ensure that the number of bits to be read is a
-                # multiple of ten
-                after_end = after_end - (after_end % 10)
 
-            while bit_ptr < after_end:
+    def unframe_bits(self, data, frames):
+        """Return the bytes held in the specified number of ten bit frames at
+        the start of the data, where each frame contains a start bit, eight
+        data bits and a stop bit, stored least significant bit first."""
 
-                # Skip start bit
-                bit_ptr = bit_ptr + 1
+        # Four frames fit exactly into five bytes, so the data is treated
+        # as groups of five bytes, padding the last group with zeros
+        groups = (frames + 3) // 4
+        data = bytes(data[:groups * 5]).ljust(groups * 5, b'\000')
 
-                # Read eight bits of data
-                bit_offset = bit_ptr % 8
-                if bit_offset == 0:
-                    # Write the byte to the block
-                    block[write_ptr] = data[bit_ptr >> 3]
-                else:
-                    # Read the byte containing the first bits
-                    b1 = data[bit_ptr >> 3]
-                    # Read the byte containing the rest
-                    b2 = data[(bit_ptr >> 3) + 1]
-
-                    # Construct a byte of data
-                    # Shift the first byte right by the bit offset
-                    # in that byte
-                    b1 = b1 >> bit_offset
-
-                    # Shift the rest of the bits from the second
-                    # byte to the left and ensure that the result
-                    # fits in a byte
-                    b2 = (b2 << (8 - bit_offset)) & 0xff
-
-                    # OR the two bytes together and write it to
-                    # the block
-                    block[write_ptr] = b1 | b2
-
-                # Increment the block pointer
-                write_ptr = write_ptr + 1
-
-                # Move the data pointer on eight bits and skip the
-                # stop bit
-                bit_ptr = bit_ptr + 9
-
-        # Read the block
-        name = b''
+        block = bytearray(groups * 4)
+
+        # The nth byte of each group is built from the high bits of the nth
+        # input byte and the low bits of the following one. Each of these is
+        # extracted for all groups at once and the two are combined.
+        for n in range(4):
+
+            low, high = unframe_tables[n]
+            low = int.from_bytes(data[n::5].translate(low), 'little')
+            high = int.from_bytes(data[n+1::5].translate(high), 'little')
+
+            block[n::4] = (low | high).to_bytes(groups, 'little')
+
+        return bytes(block[:frames])
+
+
+    def read_block(self, chunk):
+        """Read a data block from a tape chunk and return the program name, load and execution addresses,
+        block data, block number and whether the block is supposedly the last in the file."""
+
+        block = self.decode_block(chunk)
+        name, load, exec_addr, block_number, last, a = self.read_header(block)
+
+        return (name, load, exec_addr, bytes(block[a:-2]), block_number, last)
+
+
+    def read_block_header(self, chunk):
+        """Read the header of a data block from a tape chunk, decoding no more
+        of the chunk than necessary, and return the program name, load and
+        execution addresses, block number and whether the block is supposedly
+        the last in the file."""
+
+        try:
+            block = self.decode_block(chunk, max_header_length)
+            return self.read_header(block)[:5]
+        except (IndexError, struct.error):
+            # The header is longer than expected, so decode the whole block
+            return self.read_header(self.decode_block(chunk))[:5]
+
+
+    def read_header(self, block):
+        """Read the header at the start of the bytes of a data block and return
+        the program name, load and execution addresses, block number, whether
+        the block is supposedly the last in the file and the offset of the
+        block data."""
+
+        # Read the name, which is normally no more than 10 characters long
+        # and followed by a null byte
+        start = bytes(block[:12])
+        a = start.find(0, 1)
+
+        if a != -1:
+            name = start[1:a]
+            a = a + 1
+        else:
+            name = b''
+            a = 1
+            while 1:
+                c = block[a]
+                if c != 0:     # was > 32:
+                    name = name + bytes([c])
+                a = a + 1
+                if c == 0:
+                    break
+
+        load, exec_addr, block_number, length, flag, next_addr, last = \
+            block_header.unpack_from(block, a)
+
+        return (name, load, exec_addr, block_number, last, a + 19)
+
+
+    def header_length(self, block):
+        """Return the length of the header at the start of the bytes of a
+        data block, including the alignment character and header CRC."""
+
+        # The name is at most 10 characters long and is followed by a null
+        # byte. Copy the bytes that can contain it since the block may be a
+        # memoryview, which has no index method.
+        return bytes(block[:12]).index(0, 1) + 20
+
+
+    def verify_block(self, block):
+        """Check the header and data CRCs of the bytes of a data block and
+        return a tuple containing two boolean values indicating whether
+        each CRC is correct."""
+
+        # Find the end of the file name
         a = 1
-        while 1:
-            c = block[a]
-            if c != 0:     # was > 32:
-                name = name + bytes([c])
+        while a < len(block) and a <= 11 and block[a] != 0:
             a = a + 1
-            if c == 0:
-                break
 
-        load = self.str2num(4, block[a:a+4])
-        exec_addr = self.str2num(4, block[a+4:a+8])
-        block_number = self.str2num(2, block[a+8:a+10])
-        last = block[a+12]
+        if a + 20 > len(block) or block[a] != 0:
+            # The header is incomplete
+            return False, False
 
-        if last & 0x80 != 0:
-            last = 1
-        else:
-            last = 0
+        # Skip the null byte after the name
+        a = a + 1
 
-        return (name, load, exec_addr, block[a+19:-2], block_number, last)
+        header_ok = self.crc(block[1:a+17]) == block_crc.unpack_from(block, a+17)[0]
 
+        length = block_header.unpack_from(block, a)[3]
+        if length == 0:
+            # Empty blocks have no data CRC
+            return header_ok, True
 
-    def write_block(self, block, name, load, exe, n, last = 0, flags = 0):
-    
-        """Write data to a string as a file data block in preparation to be written
-        as chunk data to a UEF file."""
+        end = a + 19 + length
+        if end + 2 > len(block):
+            return header_ok, False
 
-        # Write the alignment character
-        out = b"*"+name[:10]+b"\000"
+        data_ok = self.crc(block[a+19:end]) == block_crc.unpack_from(block, end)[0]
 
-        # Load address
-        out = out + self.number(4, load)
+        return header_ok, data_ok
 
-        # Execution address
-        out = out + self.number(4, exe)
 
-        # Block number
-        out = out + self.number(2, n)
+    def verify(self):
+        """
+        Check the header and data CRCs of every file block in the list of
+        chunks. Returns a list of tuples, one for each corrupt block,
+        containing the position of the block in the list of chunks and
+        two boolean values indicating whether the header and data CRCs
+        are correct:
 
-        # Block length
-        out = out + self.number(2, len(block))
+            (position, header_ok, data_ok)
+        """
 
-        # Block flag (last block)
-        if flags:
-            out = out + self.number(1, flags)
-        elif last:
-            out = out + self.number(1, 128)
-        else:
-            out = out + self.number(1, 0)
+        corrupt = []
 
-        # Next address
-        out = out + self.number(4, 0)
+        for position in range(len(self.chunks)):
 
-        # Header CRC
-        out = out + self.number(2, self.crc(out[1:]))
+            chunk = self.chunks[position]
 
-        out = out + block
+            if chunk[0] not in (0x100, 0x102) or len(chunk[1]) <= 1:
+                continue
 
-        # Block CRC
-        out = out + self.number(2, self.crc(block))
+            try:
+                header_ok, data_ok = self.verify_block(self.decode_block(chunk))
+            except IndexError:
+                header_ok, data_ok = False, False
+
+            if not (header_ok and data_ok):
+                corrupt.append((position, header_ok, data_ok))
 
-        return out
+        return corrupt
+
+
+    def write_block(self, block, name, load, exe, n, last = 0, flags = 0):
+    
+        """Write data to a string as a file data block in preparation to be written
+        as chunk data to a UEF file."""
+
+        # Block flag (last block)
+        if not flags and last:
+            flags = 128
+
+        # File name, load and execution addresses, block number, block
+        # length, block flag and next address
+        header = name[:10] + b"\000" + block_header.pack(
+            load, exe, n, len(block), flags, 0, 0)
+
+        # Alignment character, header, header CRC, data and block CRC
+        return b"".join((b"*", header, block_crc.pack(self.crc(header)),
+                         block, block_crc.pack(self.crc(block))))
 
 
     def get_leafname(self, path):
@@ -588,27 +1072,48 @@ class UEFfile:
     def read_uef_details(self):
         """Return details about the UEF file and its contents."""
 
-        # Find the creator chunk
-        pos, chunk = self.find_next_chunk(0, [0x0])
+        # Find the first creator, target machine and emulator chunks, and
+        # the instructions, credits and inlay chunks, in a single pass
+        # through the list of chunks
+        details = (0x0, 0x5, 0xff00)
+        features = (0x1, 0x2, 0x3)
 
-        if pos == None:
+        positions = {}
+        found = set()
 
-            self.creator = 'Unknown'
+        for position, chunk_id in enumerate(self.chunk_ids()):
 
-        elif chunk[1] == b'':
+            if chunk_id in details:
+                if chunk_id not in positions:
+                    positions[chunk_id] = position
 
-            self.creator = 'Unknown'
-        else:
-            self.creator = chunk[1]
+            elif chunk_id in features:
+                found.add(chunk_id)
+
+        # Keep the creator, target machine and emulator chunks in a table
+        # of metadata and remove them from the list of chunks, since they
+        # are written separately
+        self.metadata = {}
+
+        for chunk_id, position in positions.items():
+            self.metadata[chunk_id] = bytes(self.chunks[position][1])
 
-        # Delete the creator chunk
-        if pos != None:
-            del self.chunks[pos]
+        if positions:
+            self.remove_chunks(sorted(positions.values()))
 
-        # Find the target machine chunk
-        pos, chunk = self.find_next_chunk(0, [0x5])
+        # Creator
+        creator = self.metadata.get(0x0)
+
+        if creator == None or creator == b'':
+
+            self.creator = b'Unknown'
+        else:
+            self.creator = creator
 
-        if pos == None:
+        # Target machine
+        machine_info = self.metadata.get(0x5)
+
+        if machine_info == None:
 
             self.target_machine = 'Unknown'
             self.keyboard_layout = 'Unknown'
@@ -617,8 +1122,8 @@ class UEFfile:
             machines = ('BBC Model A', 'Electron', 'BBC Model B', 'BBC Master')
             keyboards = ('Any layout', 'Physical layout', 'Remapped')
 
-            machine = chunk[1][0] & 0x0f
-            keyboard = (chunk[1][0] & 0xf0) >> 4
+            machine = machine_info[0] & 0x0f
+            keyboard = (machine_info[0] & 0xf0) >> 4
 
             if machine < len(machines):
                 self.target_machine = machines[machine]
@@ -630,44 +1135,139 @@ class UEFfile:
             else:
                 self.keyboard_layout = 'Unknown'
 
-            # Delete the target machine chunk
-            del self.chunks[pos]
-
-        # Find the emulator chunk
-        pos, chunk = self.find_next_chunk(0, [0xff00])
+        # Emulator
+        emulator = self.metadata.get(0xff00)
 
-        if pos == None:
+        if emulator == None:
 
             self.emulator = b'Unspecified'
 
-        elif chunk[1] == b'':
+        elif emulator == b'':
 
             self.emulator = b'Unknown'
         else:
-            self.emulator = chunk[1]
-
-        # Delete the emulator chunk
-        if pos != None:
-            del self.chunks[pos]
+            self.emulator = emulator
 
         # Remove trailing null bytes
-        while len(self.creator) > 0 and self.creator[-1] == b'\000':
-
-            self.creator = self.creator[:-1]
-
-        while len(self.emulator) > 0 and self.emulator[-1] == b'\000':
-
-            self.emulator = self.emulator[:-1]
+        self.creator = self.creator.rstrip(b'\000')
+        self.emulator = self.emulator.rstrip(b'\000')
 
         self.features = b''
-        if self.find_next_chunk(0, [0x1])[0] != None:
+        if 0x1 in found:
             self.features = self.features + b'\n' + b'Instructions'
-        if self.find_next_chunk(0, [0x2])[0] != None:
+        if 0x2 in found:
             self.features = self.features + b'\n' + b'Credits'
-        if self.find_next_chunk(0, [0x3])[0] != None:
+        if 0x3 in found:
             self.features = self.features + b'\n' + b'Inlay'
 
 
+    def remove_chunks(self, positions):
+        """Remove the chunks at the positions in the sorted list given from
+        the list of chunks."""
+
+        if isinstance(self.chunks, ChunkIndex):
+            self.chunks.remove(positions)
+            return
+
+        chunks = []
+        start = 0
+
+        for position in positions:
+            chunks.extend(self.chunks[start:position])
+            start = position + 1
+
+        chunks.extend(self.chunks[start:])
+        self.chunks = chunks
+
+
+    def compact(self, shorten_tones = False):
+        """
+        Normalise the list of chunks by merging adjacent tones and adjacent
+        gaps, and by removing empty tones and gaps and dummy blocks that are
+        too short to contain any data. Dummy bytes in tones are also removed,
+        with the tones on either side of them being merged.
+
+        If shorten_tones is True then the tones between consecutive blocks of
+        each file are shortened to the minimum length given by min_block_tone.
+        The tones before the first block of each file are not changed.
+
+        The contents list is updated to refer to the new chunk positions.
+        """
+
+        chunks = []
+
+        for chunk_id, data in self.chunks:
+
+            if chunk_id == 0x100 or chunk_id == 0x102:
+
+                # Remove dummy blocks
+                if len(data) <= 1:
+                    continue
+
+            elif chunk_id == 0x111:
+
+                # Replace tones containing dummy bytes with plain tones
+                chunk_id = 0x110
+                data = self.number(2, min(self.str2num(2, data[0:2]) +
+                                          self.str2num(2, data[2:4]), 0xffff))
+
+            if chunk_id == 0x110 or chunk_id == 0x112:
+
+                length = self.str2num(2, data)
+
+                if length == 0:
+                    continue
+
+                if chunks and chunks[-1][0] == chunk_id:
+
+                    # Extend the previous tone or gap as far as possible
+                    # and store any remainder in this one
+                    length = length + self.str2num(2, chunks[-1][1])
+                    chunks[-1] = (chunk_id, self.number(2, min(length, 0xffff)))
+                    length = length - 0xffff
+
+                    if length <= 0:
+                        continue
+
+                data = self.number(2, length)
+
+            elif chunk_id == 0x116:
+
+                seconds = struct.unpack("<f", data[:4])[0]
+
+                if seconds == 0:
+                    continue
+
+                if chunks and chunks[-1][0] == 0x116:
+                    seconds = seconds + struct.unpack("<f", chunks[-1][1][:4])[0]
+                    chunks[-1] = (0x116, struct.pack("<f", seconds))
+                    continue
+
+            chunks.append((chunk_id, data))
+
+        if shorten_tones:
+
+            tone = self.str2num(2, min_block_tone)
+
+            for position in range(1, len(chunks) - 1):
+
+                chunk_id, data = chunks[position]
+
+                if chunk_id != 0x110 or self.str2num(2, data) <= tone:
+                    continue
+
+                # Only shorten tones between two blocks of the same file
+                if chunks[position - 1][0] not in (0x100, 0x102) or \
+                   chunks[position + 1][0] not in (0x100, 0x102):
+                    continue
+
+                if self.read_block(chunks[position + 1])[4] != 0:
+                    chunks[position] = (0x110, min_block_tone)
+
+        self.chunks = chunks
+        self.read_contents()
+
+
     def write_uef_header(self, file):
         """Write the UEF file header and version number to a file."""
 
@@ -726,41 +1326,60 @@ class UEFfile:
     def write_chunks(self, file):
         """Write all the chunks in the list to a file. Saves having loops in other functions to do this."""
 
+        # Collect the chunk headers and data, writing them in batches
+        pieces = []
+        size = 0
+        pack = chunk_header.pack
+
         for c in self.chunks:
 
-            self.chunk(file, c[0], c[1])
+            pieces.append(pack(c[0], len(c[1])))
+            pieces.append(c[1])
+            size = size + len(c[1]) + 6
+
+            if size >= write_buffer_size:
+                file.write(b''.join(pieces))
+                pieces = []
+                size = 0
+
+        if pieces:
+            file.write(b''.join(pieces))
 
 
     def create_chunks(self, name, load, exe, data):
         """Create suitable chunks, and insert them into
         the list of chunks."""
 
+        return list(self.encode_blocks(name, load, exe, data))
+
+
+    def encode_blocks(self, name, load, exe, data):
+        """Generate the tone and block chunks needed to store a file, encoding
+        each block of the data as it is requested."""
+
+        # Read the data in 256 byte windows without copying it
+        data = memoryview(data)
+        offset = 0
+
         # Reset the block number to zero
         block_number = 0
 
-        # Long gap
-        gap = 1
-
-        new_chunks = []
-    
         # Write block details
         while True:
-        
-            last = (len(data) <= 256)
-            block = self.write_block(data[:256], name, load, exe, block_number,
-                                     last)
 
-            # Remove the leading 256 bytes as they have been encoded
-            data = data[256:]
+            block = data[offset:offset + 256]
+            offset = offset + 256
+            last = offset >= len(data)
 
-            if gap == 1:
-                new_chunks.append((0x110, self.number(2,0x05dc)))
-                gap = 0
+            # Use a long tone before the first block
+            if block_number == 0:
+                yield (0x110, first_block_tone)
             else:
-                new_chunks.append((0x110, self.number(2,0x0258)))
+                yield (0x110, block_tone)
 
-            # Write the block to the list of new chunks
-            new_chunks.append((0x100, block))
+            # Write the block
+            yield (0x100, self.write_block(block, name, load, exe,
+                                           block_number, last))
 
             if last:
                 break
@@ -768,9 +1387,6 @@ class UEFfile:
             # Increment the block number
             block_number = block_number + 1
 
-        # Return the list of new chunks
-        return new_chunks
-
 
     def import_files(self, file_position, info, gap = False):
         """
@@ -834,13 +1450,80 @@ class UEFfile:
                                     (0x110, b'\xdc\x05'),
                                     (0x100, b'\xdc')]
             
-            inserted_chunks += self.create_chunks(name, load, exe, data)
+            inserted_chunks.extend(self.encode_blocks(name, load, exe, data))
 
         # Insert the chunks in the list at the specified position
-        self.chunks = self.chunks[:position] + inserted_chunks + self.chunks[position:]
+        if isinstance(self.chunks, ChunkIndex):
+            self.chunks = list(self.chunks)
 
-        # Update the contents list
-        self.read_contents()
+        self.chunks[position:position] = inserted_chunks
+
+        # Update the contents list, moving the files after the new chunks
+        # and reading the details of the new files from their chunks
+        index = 0
+        while index < len(self.contents) and \
+            self.contents[index]['last position'] < position:
+
+            index = index + 1
+
+        self.move_contents(position, len(inserted_chunks))
+        self.contents[index:index] = self.find_files(position,
+            position + len(inserted_chunks))
+
+
+    def patch_file(self, file_position, data):
+        """
+        Replace the data of the file at the specified position in the list
+        of contents with new data of the same length. Only the blocks that
+        contain changed data are encoded again; all other chunks are left
+        unchanged.
+        """
+
+        if file_position < 0 or file_position >= len(self.contents):
+
+            raise UEFfile_error('File position %i does not correspond to an actual file.' % file_position)
+
+        details = self.contents[file_position]
+        old_data = details['data']
+        data = bytes(data)
+
+        if len(data) != len(old_data):
+
+            raise UEFfile_error('The new data must be the same length as the existing data.')
+
+        if data == old_data:
+            return
+
+        if isinstance(self.chunks, ChunkIndex):
+            self.chunks = list(self.chunks)
+
+        # Find the range of the file's data held in each block
+        offset = 0
+
+        for position in range(details['position'], details['last position'] + 1):
+
+            chunk = self.chunks[position]
+
+            if chunk[0] not in (0x100, 0x102) or len(chunk[1]) <= 1:
+                continue
+
+            block = self.decode_block(chunk)
+            header = self.header_length(block)
+
+            end = offset + len(block) - header - 2
+            new_block_data = data[offset:end]
+
+            if new_block_data != old_data[offset:end]:
+
+                # Keep the block header and its CRC, replacing the data and
+                # the data CRC
+                block = bytes(block[:header]) + new_block_data + \
+                        block_crc.pack(self.crc(new_block_data))
+                self.chunks[position] = (0x100, block)
+
+            offset = end
+
+        details['data'] = data
 
 
     def chunk_number(self, name):
@@ -935,7 +1618,7 @@ class UEFfile:
 
             file_positions = [file_positions]
 
-        positions = []
+        removed = set()
         for file_position in file_positions:
     
             # Find the chunk position which corresponds to the file position
@@ -944,22 +1627,62 @@ class UEFfile:
                 print('File position %i does not correspond to an actual file.' % file_position)
     
             else:
-                # Add the chunk positions within each file to the list of positions
-                positions = positions + list(range(self.contents[file_position]['position'],
-                                  self.contents[file_position]['last position'] + 1))
-    
-        # Create a new list of chunks without those in the positions list
-        new_chunks = []
-        for c in range(0, len(self.chunks)): 
-    
-            if c not in positions:
-                new_chunks.append(self.chunks[c])
+                removed.add(file_position)
 
-        # Overwrite the chunks list with this new list
-        self.chunks = new_chunks
+        # Find the ranges of chunks to remove, from the last to the first
+        ranges = []
+        for file_position in sorted(removed, reverse = True):
 
-        # Create a new contents list
-        self.read_contents()        
+            ranges.append((self.contents[file_position]['position'],
+                           self.contents[file_position]['last position'] + 1))
+
+        remaining = []
+        for file_position in range(len(self.contents)):
+
+            if file_position not in removed:
+                remaining.append(self.contents[file_position])
+
+        # Files are normally separated from each other, so the chunks for
+        # each of them can be removed and the remaining files moved. If the
+        # chunks are shared with other files, rebuild the contents list.
+        separate = True
+        end = len(self.chunks)
+
+        for start, finish in ranges:
+
+            if finish > end:
+                separate = False
+            end = start
+
+            for details in remaining:
+                if start <= details['position'] < finish or \
+                   start <= details['last position'] < finish:
+                    separate = False
+
+        if isinstance(self.chunks, ChunkIndex):
+            self.chunks = list(self.chunks)
+
+        if not separate:
+
+            positions = set()
+            for start, finish in ranges:
+                positions.update(range(start, finish))
+
+            # Create a new list of chunks without those in the positions list
+            self.chunks = [self.chunks[c] for c in range(len(self.chunks))
+                           if c not in positions]
+
+            # Create a new contents list
+            self.read_contents()
+            return
+
+        # Remove the chunks for each file and move the files after them
+        self.contents = remaining
+
+        for start, finish in ranges:
+
+            del self.chunks[start:finish]
+            self.move_contents(finish, start - finish)
 
 
     def printable(self, s):
@@ -1126,3 +1849,62 @@ class UEFfile:
             n = n + 1
 
         print()
+
+
+if __name__ == "__main__":
+
+    usage = ("Usage: %s verify <UEF file> ...\n"
+             "       %s compact [-s] <UEF file> <new UEF file>\n") % (sys.argv[0], sys.argv[0])
+
+    if len(sys.argv) >= 4 and sys.argv[1] == "compact":
+
+        # Compact the chunks in a file, optionally shortening the tones
+        # between blocks
+        args = sys.argv[2:]
+        shorten_tones = args[0] == "-s"
+        if shorten_tones:
+            args = args[1:]
+
+        if len(args) != 2:
+            sys.stderr.write(usage)
+            sys.exit(1)
+
+        try:
+            u = UEFfile(args[0])
+            u.compact(shorten_tones)
+            u.write(args[1])
+        except UEFfile_error as exception:
+            sys.stderr.write("%s\n" % exception)
+            sys.exit(1)
+
+        sys.exit()
+
+    if len(sys.argv) < 3 or sys.argv[1] != "verify":
+
+        sys.stderr.write(usage)
+        sys.exit(1)
+
+    failed = False
+
+    for path in sys.argv[2:]:
+
+        try:
+            u = UEFfile(path, lazy = True)
+        except UEFfile_error as exception:
+            sys.stderr.write("%s: %s\n" % (path, exception))
+            failed = True
+            continue
+
+        for position, header_ok, data_ok in u.verify():
+
+            if not header_ok:
+                print("%s: chunk %i: header CRC error" % (path, position))
+            if not data_ok:
+                print("%s: chunk %i: data CRC error" % (path, position))
+
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+    sys.exit()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+
+"""
+UEFindex.py - Maintain persistent indexes of the contents of UEF archives.
+
+Copyright (C) 2026 The ReptonMaps contributors
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gzip, hashlib, json, os
+
+from UEFfile import UEFfile, UEFfile_error, gzip_header
+
+# The version of the index format
+index_version = 2
+
+# The suffix added to the name of a UEF file to obtain the name of its index
+index_suffix = '.idx'
+
+
+class UEFIndex:
+    """index = UEFIndex(filename, index_filename)
+
+    Describe the contents of the UEF file with the specified filename using
+    an index stored in a separate file. If index_filename is not defined
+    then the index is stored alongside the UEF file with the same name and
+    an additional .idx suffix.
+
+    The index records the file's size, modification time and a hash of its
+    contents, so that it can be reused until the file changes. If there is
+    no valid index for the file then it is created when the instance is
+    created and written to the index file if possible.
+
+    The contents attribute is a list of dictionaries like the one used by
+    UEFfile, except that the file data is not included; the 'length' entry
+    gives the length of the data instead. The results of checking the CRCs
+    of the file's blocks are also recorded and returned by the verify
+    method.
+    """
+
+    def __init__(self, filename, index_filename = None):
+
+        self.filename = filename
+
+        if index_filename == None:
+            index_filename = filename + index_suffix
+
+        self.index_filename = index_filename
+
+        # Use the existing index, if there is one, or create a new one
+        if not self.load():
+            self.build()
+            self.try_save()
+
+
+    def file_key(self):
+        """Return the size and modification time of the UEF file."""
+
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            raise UEFfile_error('The input file, '+self.filename+' could not be found.')
+
+        return st.st_size, st.st_mtime_ns
+
+
+    def file_hash(self):
+        """Return a hash of the contents of the UEF file."""
+
+        h = hashlib.sha1()
+
+        f = open(self.filename, 'rb')
+        while True:
+            data = f.read(0x10000)
+            if not data:
+                break
+            h.update(data)
+        f.close()
+
+        return h.hexdigest()
+
+
+    def load(self):
+        """Read the index for the UEF file, returning True if it was found
+        and is still valid for the file, or False if it needs to be built."""
+
+        try:
+            f = open(self.index_filename, 'r')
+            index = json.load(f)
+            f.close()
+        except (IOError, ValueError):
+            return False
+
+        size, mtime = self.file_key()
+
+        # Treat an index with missing or malformed entries as out of date
+        try:
+            if index.get('version') != index_version:
+                return False
+
+            if index['size'] != size:
+                return False
+
+            if index['mtime'] != mtime:
+
+                # The file may have been touched or copied without being
+                # changed, in which case the index can be kept
+                if index['hash'] != self.file_hash():
+                    return False
+
+                index['mtime'] = mtime
+                self.read_index(index)
+                self.try_save()
+            else:
+                self.read_index(index)
+
+        except (AttributeError, KeyError, TypeError):
+            return False
+
+        return True
+
+
+    def build(self):
+        """Read the UEF file and record the details of its chunks and the
+        files it contains."""
+
+        size, mtime = self.file_key()
+
+        f = open(self.filename, 'rb')
+        compressed = f.read(2) == gzip_header
+        f.close()
+
+        uef = UEFfile(self.filename, lazy = True)
+        chunks = uef.chunks
+
+        contents = []
+        for details in uef.contents:
+
+            contents.append({
+                'name': details['name'].decode('latin1'),
+                'load': details['load'], 'exec': details['exec'],
+                'blocks': details['blocks'], 'length': len(details['data']),
+                'position': details['position'],
+                'last position': details['last position']})
+
+        self.read_index({
+            'version': index_version, 'size': size, 'mtime': mtime,
+            'hash': self.file_hash(), 'compressed': compressed,
+            'minor': uef.minor, 'major': uef.major,
+            'creator': uef.creator.decode('latin1'),
+            'target machine': uef.target_machine,
+            'keyboard layout': uef.keyboard_layout,
+            'emulator': uef.emulator.decode('latin1'),
+            'features': uef.features.decode('latin1'),
+            'chunk ids': chunks.ids.tolist(),
+            'chunk offsets': chunks.offsets.tolist(),
+            'chunk lengths': chunks.lengths.tolist(),
+            'contents': contents,
+            'corrupt blocks': [list(block) for block in uef.verify()]})
+
+
+    def read_index(self, index):
+        """Store the details held in an index in the instance."""
+
+        self.index = index
+
+        self.minor = index['minor']
+        self.major = index['major']
+        self.creator = index['creator'].encode('latin1')
+        self.target_machine = index['target machine']
+        self.keyboard_layout = index['keyboard layout']
+        self.emulator = index['emulator'].encode('latin1')
+        self.features = index['features'].encode('latin1')
+
+        self.contents = []
+        for details in index['contents']:
+
+            details = dict(details)
+            details['name'] = details['name'].encode('latin1')
+            self.contents.append(details)
+
+        self.corrupt = [tuple(block) for block in index['corrupt blocks']]
+
+
+    def save(self):
+        """Write the index to the index file."""
+
+        try:
+            f = open(self.index_filename, 'w')
+            json.dump(self.index, f, separators = (',', ':'))
+            f.close()
+        except IOError:
+            raise UEFfile_error("Couldn't open %s for writing." % self.index_filename)
+
+
+    def try_save(self):
+        """Write the index to the index file if possible, returning True if
+        it was written. The index can still be used if it cannot be written,
+        as when the UEF file is on a read-only file system."""
+
+        try:
+            self.save()
+        except UEFfile_error:
+            return False
+
+        return True
+
+
+    def find_file(self, name):
+        """Return the position in the list of contents of the first file with
+        the name given, or None if there is no such file."""
+
+        for file_position in range(len(self.contents)):
+
+            if self.contents[file_position]['name'] == name:
+                return file_position
+
+        return None
+
+
+    def verify(self):
+        """
+        Returns the list of corrupt blocks found in the UEF file when the
+        index was built, in the form returned by UEFfile.verify:
+
+            (position, header_ok, data_ok)
+        """
+
+        return self.corrupt
+
+
+    def read_chunks(self, positions):
+        """Return a dictionary mapping the chunk positions given to the chunks
+        found at those positions, reading only the data for those chunks."""
+
+        ids = self.index['chunk ids']
+        offsets = self.index['chunk offsets']
+        lengths = self.index['chunk lengths']
+
+        if self.index['compressed']:
+            f = gzip.open(self.filename, 'rb')
+        else:
+            f = open(self.filename, 'rb')
+
+        # Read the chunks in the order they occur in the file so that
+        # compressed files are only decompressed once
+        chunks = {}
+        for position in sorted(positions):
+
+            f.seek(offsets[position])
+            chunks[position] = (ids[position], f.read(lengths[position]))
+
+        f.close()
+        return chunks
+
+
+    def export_files(self, file_positions):
+        """
+        Given a file's location of the list of contents, returns its name,
+        load and execution addresses, and the data contained in the file,
+        reading only the chunks that contain the file's blocks.
+        If positions is an integer then return a tuple
+
+            info = (name, load, exe, data)
+
+        If positions is a list then return a list of info tuples.
+        """
+
+        if type(file_positions) == int:
+
+            file_positions = [file_positions]
+
+        ids = self.index['chunk ids']
+        lengths = self.index['chunk lengths']
+
+        # Find the blocks for each file
+        blocks = {}
+        for file_position in file_positions:
+
+            if file_position < 0 or file_position >= len(self.contents):
+
+                raise UEFfile_error('File position %i does not correspond to an actual file.' % file_position)
+
+            details = self.contents[file_position]
+            blocks[file_position] = []
+
+            for position in range(details['position'], details['last position'] + 1):
+
+                if ids[position] in (0x100, 0x102) and lengths[position] > 1:
+                    blocks[file_position].append(position)
+
+        positions = set()
+        for file_blocks in blocks.values():
+            positions.update(file_blocks)
+
+        chunks = self.read_chunks(positions)
+
+        # Decode the blocks using a UEFfile with the same format version
+        uef = UEFfile()
+        uef.minor = self.minor
+        uef.major = self.major
+
+        info = []
+        for file_position in file_positions:
+
+            details = self.contents[file_position]
+            data = b''.join([uef.read_block(chunks[position])[3]
+                             for position in blocks[file_position]])
+
+            info.append( (details['name'], details['load'], details['exec'], data) )
+
+        if len(info) == 1:
+            info = info[0]
+
+        return info
+
+
+    def cat(self):
+        """
+        Prints a catalogue of the files stored in the UEF file.
+        """
+
+        if self.contents == []:
+
+            print('No files')
+
+        else:
+
+            print('Contents:')
+
+            uef = UEFfile()
+            file_number = 0
+
+            for file in self.contents:
+
+                # Converts non printable characters in the filename
+                # to ? symbols
+                new_name = uef.printable(file['name'])
+
+                print("{0:<3}: {1:<16}{2:<10X}{3:<10X}{4:<6X} chunks {5} to {6}".format(
+                    file_number, new_name, file['load'], file['exec'],
+                    file['length'], file['position'], file['last position']))
+
+                file_number = file_number + 1
@@ -17,9 +17,20 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import struct, time
 
+from records import compile_struct
+
 # Find the number of centiseconds between 1900 and 1970.
 between_epochs = ((365 * 70) + 17) * 24 * 360000
 
+# Compiled structures for the little endian values read and written by the
+# Utilities class
+signed_word = compile_struct("<i")
+unsigned_word = compile_struct("<I")
+signed_half_word = compile_struct("<h")
+unsigned_half_word = compile_struct("<H")
+signed_byte = compile_struct("<b")
+unsigned_byte = compile_struct("<B")
+
 class DiskError(Exception):
     pass
 
@@ -30,27 +41,27 @@ class Utilities:
     
     def _read_signed_word(self, s):
     
-        return struct.unpack("<i", s)[0]
+        return signed_word.unpack(s)[0]
     
     def _read_unsigned_word(self, s):
     
-        return struct.unpack("<I", s)[0]
+        return unsigned_word.unpack(s)[0]
     
     def _read_signed_byte(self, s):
     
-        return struct.unpack("<b", s)[0]
+        return signed_byte.unpack(s)[0]
     
     def _read_unsigned_byte(self, s):
     
-        return struct.unpack("<B", s)[0]
+        return unsigned_byte.unpack(s)[0]
     
     def _read_unsigned_half_word(self, s):
     
-        return struct.unpack("<H", s)[0]
+        return unsigned_half_word.unpack(s)[0]
     
     def _read_signed_half_word(self, s):
     
-        return struct.unpack("<h", s)[0]
+        return signed_half_word.unpack(s)[0]
     
     def _read(self, offset, length = 1):
     
@@ -59,15 +70,15 @@ class Utilities:
     
     def _write_unsigned_word(self, v):
     
-        return struct.pack("<I", v)
+        return unsigned_word.pack(v)
     
     def _write_unsigned_half_word(self, v):
     
-        return struct.pack("<H", v)
+        return unsigned_half_word.pack(v)
     
     def _write_unsigned_byte(self, v):
     
-        return struct.pack("<B", v)
+        return unsigned_byte.pack(v)
     
     def _write(self, offset, data):
     
@@ -76,44 +87,18 @@ class Utilities:
     
     def _str2num(self, s):
     
-        i = 0
-        n = 0
-        while i < len(s):
-        
-            n = n | (s[i] << (i*8))
-            i = i + 1
-        
-        return n
+        return int.from_bytes(s, "little")
     
     def _num2str(self, size, n):
     
-        i = 0
-        s = ""
-        while i < size:
-        
-            s += chr(n & 0xff)
-            n = n >> 8
-            i += 1
-        
-        return s
+        return (n & ((1 << (size * 8)) - 1)).to_bytes(size, "little")
     
     def _binary(self, size, n):
     
-        new = ""
-        while (n != 0) & (size > 0):
-        
-            if (n & 1)==1:
-                new = "1" + new
-            else:
-                new = "0" + new
-            
-            n = n >> 1
-            size = size - 1
-        
-        if size > 0:
-            new = ("0"*size) + new
+        if size <= 0:
+            return ""
         
-        return new
+        return format(n & ((1 << size) - 1), "0%ib" % size)
     
     def _safe(self, s, with_space = 0):
     
@@ -166,23 +151,40 @@ class Directory:
 class File:
 
     """file = File(name, data, load_address, execution_address, length)
+    
+    If data is None and a reader is given, the file's data is obtained by
+    calling reader(disk_address, length) when it is first used.
     """
     
     def __init__(self, name, data, load_address, execution_address, length,
-                       locked = False, disk_address = 0):
+                       locked = False, disk_address = 0, reader = None):
     
         self.name = name
-        self.data = data
+        self._data = data
         self.load_address = load_address
         self.execution_address = execution_address
         self.length = length
         self.locked = locked
         self.disk_address = disk_address
+        self.reader = reader
     
     def __repr__(self):
     
         return '<%s instance, "%s", at %x>' % (self.__class__, self.name, id(self))
     
+    @property
+    def data(self):
+    
+        if self._data is None and self.reader is not None:
+            self._data = self.reader(self.disk_address, self.length)
+        
+        return self._data
+    
+    @data.setter
+    def data(self, data):
+    
+        self._data = data
+    
     def has_filetype(self):
     
         """Returns True if the file's meta-data contains filetype information."""
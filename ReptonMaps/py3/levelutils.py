@@ -0,0 +1,82 @@
+"""
+levelutils.py - Pack and unpack the rows of cells in Repton level data.
+
+Copyright (C) 2026 The ReptonMaps contributors
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Each row of a level holds 32 cells of 5 bits, packed into 20 bytes from
+# the lowest bit of the first byte upwards.
+row_cells = 32
+row_bytes = 20
+cell_bits = 5
+
+# Masks that select the first cell in every row of a block of rows, indexed
+# by the number of rows
+row_masks = {}
+
+def row_mask(rows):
+
+    try:
+        return row_masks[rows]
+    except KeyError:
+        mask = int.from_bytes((b"\x1f" + (b"\x00" * (row_bytes - 1))) * rows, "little")
+        row_masks[rows] = mask
+        return mask
+
+
+def unpack_rows(data):
+
+    """Returns the cells of the rows packed in the bytes-like object given
+    as a bytes object containing one cell in each byte, in row order.
+
+    The whole block of rows is treated as a single integer. Since each row
+    occupies a whole number of bytes, shifting the integer and masking it
+    with the row mask obtains the cells in one column of every row, found
+    at the start of each row's bytes."""
+
+    rows = len(data) // row_bytes
+    length = rows * row_bytes
+
+    value = int.from_bytes(data[:length], "little")
+    mask = row_mask(rows)
+    cells = bytearray(rows * row_cells)
+
+    for column in range(row_cells):
+        column_cells = ((value >> (column * cell_bits)) & mask).to_bytes(length, "little")
+        cells[column::row_cells] = column_cells[::row_bytes]
+
+    return bytes(cells)
+
+
+def pack_rows(cells):
+
+    """Returns the bytes holding the rows of cells in the sequence given,
+    which contains the cells of each row in turn, using the reverse of the
+    process used by unpack_rows. Only the lowest 5 bits of each cell are
+    stored."""
+
+    rows = len(cells) // row_cells
+    length = rows * row_bytes
+
+    mask = row_mask(rows)
+    column_cells = bytearray(length)
+    value = 0
+
+    for column in range(row_cells):
+        column_cells[::row_bytes] = cells[column:rows * row_cells:row_cells]
+        value |= (int.from_bytes(column_cells, "little") & mask) << (column * cell_bits)
+
+    return value.to_bytes(length, "little")
@@ -20,179 +20,763 @@ __date__ = "2014-04-22"
 __version__ = "0.1"
 __license__ = "GNU General Public License (version 3 or later)"
 
-from io import StringIO
+import array, mmap, re
+from io import BytesIO
 from diskutils import Directory, DiskError, File, Utilities
+from records import Record
+
+# The end of the disk title, the disk cycle, the offset of the last entry,
+# the boot option and sector count in the second catalogue sector.
+catalogue_info = Record(
+    (("title", 0, "4s"), ("cycle", 4, 1), ("last entry", 5, 1),
+     ("extra", 6, 1), ("sectors", 7, 1)),
+    (("sectors", "extra", 0x03, 8), ("boot option", "extra", 0x30, -4)))
+
+# The name and directory of each file in the first catalogue sector, with
+# the top bit of the directory indicating whether the file is locked.
+catalogue_name = Record(
+    (("name", 0, "7s"), ("directory", 7, 1)),
+    (("locked", "directory", 0x80, -7),))
+
+# The low bits of each file's load address, execution address and length,
+# followed by their high bits and the start sector, in the second sector.
+catalogue_address = Record(
+    (("load", 0, 2), ("exec", 2, 2), ("length", 4, 2), ("extra", 6, 1),
+     ("start", 7, 1)),
+    (("start", "extra", 0x03, 8), ("load", "extra", 0x0c, 14),
+     ("length", "extra", 0x30, 12), ("exec", "extra", 0xc0, 10)))
+
+# The bytes at the start of the third sector of a disk that indicate the
+# presence of a Watford DFS extended catalogue.
+watford_marker = b"\xaa" * 8
+
+# The number of sectors in each track of a disk.
+sectors_per_track = 10
+
+
+def make_sector_table(tracks, sides, side, sector_size = 256):
+
+    """Returns an array containing the offset in a disk image of each sector
+    on the side of the disk given, where the tracks of each side are stored
+    alternately in the image."""
+    
+    table = array.array("I")
+    track_size = sectors_per_track * sector_size
+    
+    for track in range(tracks):
+        start = ((track * sides) + side) * track_size
+        table.extend(range(start, start + track_size, sector_size))
+    
+    return table
+
+
+def is_dfs_image(data):
+
+    """Returns True if the data appears to contain a DFS disk image, judging
+    by the contents of its catalogue."""
+    
+    if len(data) < 0x200:
+        return False
+    
+    # The disk title must contain printable characters or null bytes.
+    for c in bytes(data[0:8]) + bytes(data[0x100:0x104]):
+        if c != 0 and not 32 <= c < 127:
+            return False
+    
+    # The offset of the last catalogue entry must be a multiple of eight
+    # that fits in the catalogue, and the unused bits of the boot option
+    # byte must be zero.
+    last_entry = data[0x105]
+    if last_entry % 8 != 0 or last_entry > 31 * 8:
+        return False
+    
+    if data[0x106] & 0xcc != 0:
+        return False
+    
+    sectors = data[0x107] | ((data[0x106] & 0x03) << 8)
+    if sectors < 2:
+        return False
+    
+    p = 8
+    while p <= last_entry:
+    
+        # The name and directory characters must be printable, ignoring
+        # the top bit used for attributes.
+        for c in data[p:p + 8]:
+            if not 32 <= (c & 0x7f) < 127:
+                return False
+        
+        # Files must start after the catalogue and on the disk.
+        start_sector = data[0x100 + p + 7] | ((data[0x100 + p + 6] & 0x03) << 8)
+        if not 2 <= start_sector < sectors:
+            return False
+        
+        p += 8
+    
+    return True
+
+
+class SectorBitmap:
+
+    """bitmap = SectorBitmap(sectors, reserved)
+    
+    Records which of the sectors on a disk are in use, with one byte for each
+    sector, so that runs of free sectors can be found using regular
+    expressions. The reserved sectors at the start of the disk, which hold
+    the catalogue, are initially in use.
+    """
+    
+    free_run = re.compile(b"\x00+")
+    
+    def __init__(self, sectors, reserved = 2):
+    
+        self.sectors = sectors
+        self.used = bytearray(sectors)
+        self.mark(0, reserved)
+    
+    def mark(self, sector, count, used = True):
+    
+        """Marks the number of sectors given, starting at the sector given,
+        as used or free. Sectors beyond the end of the disk are ignored."""
+        
+        end = min(sector + count, self.sectors)
+        if sector < end:
+            self.used[sector:end] = (b"\x01" if used else b"\x00") * (end - sector)
+    
+    def free(self, sector, count):
+    
+        self.mark(sector, count, False)
+    
+    def runs(self):
+    
+        """Returns a list of (sector, length) tuples describing the runs of
+        free sectors on the disk."""
+        
+        return [(m.start(), m.end() - m.start())
+                for m in self.free_run.finditer(self.used)]
+    
+    def free_sectors(self):
+    
+        return self.used.count(0)
+    
+    def largest_run(self):
+    
+        """Returns the length of the longest run of free sectors."""
+        
+        return max([length for sector, length in self.runs()] or [0])
+    
+    def find_run(self, count):
+    
+        """Returns the first sector of the first run of at least the number
+        of free sectors given, or None if there is no such run."""
+        
+        if count == 0:
+            sector = self.used.find(0)
+            return sector if sector != -1 else self.sectors
+        
+        m = re.search(b"\x00{%i}" % count, self.used)
+        if m:
+            return m.start()
+        
+        return None
+    
+    def best_fit(self, count):
+    
+        """Returns the first sector of the shortest run of at least the number
+        of free sectors given, or None if there is no such run."""
+        
+        best = None
+        
+        for sector, length in self.runs():
+            if length >= count and (best is None or length < best[1]):
+                best = (sector, length)
+                if length == count:
+                    break
+        
+        if best is None:
+            return self.find_run(count)
+        
+        return best[0]
+    
+    def allocate(self, count, best_fit = False):
+    
+        """Marks a run of the number of sectors given as used, returning its
+        first sector. The first run that is long enough is used unless
+        best_fit is True, in which case the shortest suitable run is used."""
+        
+        if best_fit:
+            sector = self.best_fit(count)
+        else:
+            sector = self.find_run(count)
+        
+        if sector is None:
+            raise DiskError("Failed to find %i free sectors." % count)
+        
+        self.mark(sector, count)
+        return sector
+
 
 class Catalogue(Utilities):
 
-    def __init__(self, file):
+    """catalogue = Catalogue(file, sectors, sector_offsets)
+    
+    Reads and writes the Acorn DFS catalogue and files on one side of a disk
+    held in a file object, bytearray or memory mapping. If sector_offsets
+    is given, it is an array containing the offset of each logical sector
+    of the side in the disk image; otherwise the sectors are stored in order.
+    """
+    
+    # The maximum number of files and the number of catalogue sectors
+    max_files = 31
+    catalogue_sectors = 2
+    
+    def __init__(self, file, sectors = 800, sector_offsets = None):
     
         self.file = file
         self.sector_size = 256
+        self.sector_offsets = sector_offsets
+        
+        # Disk images held in memory or mapped into memory are accessed
+        # using views of their contents instead of copies.
+        if isinstance(file, (bytearray, mmap.mmap)):
+            self.view = memoryview(file)
+        else:
+            self.view = None
         
         # The free space map initially contains all the space after the
         # catalogue.
-        self.free_space = [(2, 798)]
-        self.sectors = 800
+        self.sectors = sectors
+        self.bitmap = self._new_bitmap()
         self.disk_cycle = 0
         self.boot_option = 0
     
-    def read_free_space(self):
+    def _new_bitmap(self):
+    
+        return SectorBitmap(self.sectors, self.catalogue_sectors)
+    
+    @property
+    def free_space(self):
+    
+        """A list of (sector, length) tuples describing the free space."""
+        
+        return self.bitmap.runs()
+    
+    def _sectors_used(self, length):
+    
+        return (length + self.sector_size - 1) // self.sector_size
     
+    def read_free_space(self, files = None):
+    
+        """Builds the free space map from the files in the catalogue, or from
+        the list of files given, returning the list of free runs."""
+        
         # Using notes from http://mdfs.net/Docs/Comp/Disk/Format/DFS
         
-        self.free_space = []
+        if files is None:
+            title, files = self.read()
+        
+        self.bitmap = self._new_bitmap()
+        
+        for file in files:
+            self.bitmap.mark(file.disk_address // self.sector_size,
+                             self._sectors_used(file.length))
+        
+        return self.free_space
     
     def read(self):
     
-        disk_title = self._read(0, 8) + self._read(0x100, 4)
-        self.disk_cycle = self._read_unsigned_byte(self._read(0x104, 1))
-        last_entry = self._read_unsigned_byte(self._read(0x105, 1))
-        extra = self._read_unsigned_byte(self._read(0x106, 1))
-        sectors = self._read_unsigned_byte(self._read(0x107, 1))
-        self.sectors = sectors | ((extra & 0x03) << 8)
-        self.boot_option = (extra & 0x30) >> 4
+        # Read both catalogue sectors at once.
+        catalogue = self._read(0, 0x200)
+        if len(catalogue) < 0x200:
+            raise DiskError("Failed to read the disk catalogue.")
+        
+        title_end, self.disk_cycle, last_entry, extra, self.sectors, \
+            self.boot_option = catalogue_info.unpack_from(catalogue, 0x100)
+        
+        disk_title = catalogue[0:8] + title_end
+        
+        return disk_title, self._read_entries(catalogue, last_entry)
+    
+    def _read_entries(self, catalogue, last_entry):
+    
+        # The entries are stored at the same offsets in both sectors.
+        count = last_entry // 8
+        names = catalogue_name.unpack_all(catalogue, 8, count)
+        addresses = catalogue_address.unpack_all(catalogue, 0x108, count)
         
         files = []
-        p = 8
         
-        while p <= last_entry:
+        for (name, directory, locked), (load, exec_, length, extra, file_start_sector) in \
+            zip(names, addresses):
         
-            name = self._read(p, 7)
-            if name[0] == "\x00":
+            if name[:1] == b"\x00":
                 break
             
             name = name.strip()
-            extra = self._read_unsigned_byte(self._read(p + 7))
-            prefix = bytes([extra & 0x7f])
-            locked = (extra & 0x80) != 0
-            
-            load = self._read_unsigned_half_word(self._read(0x100 + p, 2))
-            exec_ = self._read_unsigned_half_word(self._read(0x100 + p + 2, 2))
-            length = self._read_unsigned_half_word(self._read(0x100 + p + 4, 2))
-            
-            extra = self._read_unsigned_byte(self._read(0x100 + p + 6))
-            load = load | ((extra & 0x0c) << 14)
-            length = length | ((extra & 0x30) << 12)
-            exec_ = exec_ | ((extra & 0xc0) << 10)
+            prefix = bytes([directory & 0x7f])
             
             if load & 0x30000 == 0x30000:
                 load = load | 0xfc0000
             if exec_ & 0x30000 == 0x30000:
                 exec_ = exec_ | 0xfc0000
             
-            file_start_sector = self._read_unsigned_byte(self._read(0x100 + p + 7))
-            file_start_sector = file_start_sector | ((extra & 0x03) << 8)
+            # The data is only read when it is used.
+            files.append(File(prefix + b"." + name, None, load, exec_, length, locked != 0,
+                              file_start_sector * self.sector_size, self._read_data))
+        
+        return files
+    
+    def _pieces(self, offset, length):
+    
+        """Returns a list of (offset, length) tuples describing the parts of
+        the disk image that contain the given range of logical offsets."""
+        
+        if self.sector_offsets is None:
+            return [(offset, length)]
+        
+        table = self.sector_offsets
+        size = self.sector_size
+        end = offset + length
+        pieces = []
+        
+        while offset < end:
+        
+            sector, within = divmod(offset, size)
+            if sector >= len(table):
+                raise DiskError("Sector %i is beyond the end of the disk." % sector)
             
-            data = self._read(file_start_sector * self.sector_size, length)
+            # Extend the piece over the following sectors that are stored
+            # after it in the image.
+            start = table[sector] + within
+            n = min(end - offset, size - within)
+            sector += 1
             
-            files.append(File(prefix + b"." + name, data, load, exec_, length, locked,
-                              file_start_sector * self.sector_size))
+            while offset + n < end and sector < len(table) and \
+                  table[sector] == table[sector - 1] + size:
+                n = min(end - offset, n + size)
+                sector += 1
             
-            p += 8
+            pieces.append((start, n))
+            offset += n
         
-        return disk_title, files
+        return pieces
+    
+    def _read(self, offset, length = 1):
+    
+        pieces = []
+        
+        for start, n in self._pieces(offset, length):
+        
+            if self.view is not None:
+                pieces.append(self.view[start:start + n].tobytes())
+            else:
+                pieces.append(Utilities._read(self, start, n))
+        
+        return b"".join(pieces)
+    
+    def _write(self, offset, data):
+    
+        data = memoryview(data)
+        i = 0
+        
+        for start, n in self._pieces(offset, len(data)):
+        
+            if self.view is not None:
+                self.view[start:start + n] = data[i:i + n]
+            else:
+                Utilities._write(self, start, data[i:i + n])
+            
+            i += n
+    
+    def _read_data(self, offset, length):
+    
+        # Files stored in one part of a mapped image are returned as views.
+        pieces = self._pieces(offset, length)
+        
+        if self.view is not None and len(pieces) == 1:
+            start, n = pieces[0]
+            return self.view[start:start + n]
+        else:
+            return self._read(offset, length)
+    
+    def patch_file(self, file, data):
+    
+        """Replaces the data of a file read from the catalogue with new data
+        of the same length, writing it over the existing data on the disk.
+        Only the sectors whose contents have changed are written. Returns
+        the number of sectors written."""
+        
+        if len(data) != file.length:
+            raise DiskError("Cannot change the length of file: %s" % file.name)
+        
+        if self.view is not None and self.view.readonly:
+            raise DiskError("Cannot write to a read-only disk image.")
+        
+        offset = file.disk_address
+        old = self._read_data(offset, file.length)
+        data = memoryview(data)
+        written = 0
+        
+        for i in range(0, file.length, self.sector_size):
+        
+            new_sector = data[i:i + self.sector_size]
+            
+            if old[i:i + self.sector_size] != new_sector:
+                self._write(offset + i, new_sector)
+                written += 1
+        
+        if self.view is not None:
+            # The file's view of the disk now contains the new data.
+            file.data = self._read_data(offset, file.length)
+        else:
+            file.data = data.tobytes()
+        
+        return written
     
     def write(self, disk_title, files):
     
-        if len(files) > 31:
+        """Writes the files given to an otherwise empty disk, storing them
+        one after another from the start of the disk, and writes the
+        catalogue."""
+        
+        if len(files) > self.max_files:
+            raise DiskError("Too many entries to write.")
+        
+        self.bitmap = self._new_bitmap()
+        
+        for file in files:
+            self._write_file(file)
+        
+        self.write_catalogue(disk_title, files)
+    
+    def add_files(self, files):
+    
+        """Adds the files given to the disk, placing each of them in the
+        smallest space that will hold it without moving the files already
+        on the disk, and updates the catalogue."""
+        
+        disk_title, existing = self.read()
+        
+        if len(existing) + len(files) > self.max_files:
             raise DiskError("Too many entries to write.")
         
-        disk_name = self._pad(self._safe(disk_title), 12, " ")
+        self.read_free_space(existing)
+        
+        for file in files:
+            self._write_file(file, best_fit = True)
+        
+        self.write_catalogue(disk_title, existing + files)
+    
+    def defragment(self):
+    
+        """Moves the files on the disk towards the start of the disk so that
+        all the free space is in one run at the end, and updates the
+        catalogue. Returns the list of files in their new positions."""
+        
+        disk_title, files = self.read()
+        
+        # Moving the files in the order they occur on the disk means that
+        # each file is moved over free space or its own data, never over
+        # data that has not been moved yet.
+        files.sort(key = lambda file: file.disk_address)
+        self.bitmap = self._new_bitmap()
+        
+        for file in files:
+        
+            sector = self.bitmap.allocate(self._sectors_used(file.length))
+            disk_address = sector * self.sector_size
+            
+            if disk_address != file.disk_address:
+                self._write(disk_address, self._read(file.disk_address, file.length))
+                file.disk_address = disk_address
+                # Read the data from its new location when it is next used.
+                file.data = None
+        
+        self.write_catalogue(disk_title, files)
+        return files
+    
+    def _write_file(self, file, best_fit = False):
+    
+        # Obtain the data before the file's address is changed, since the
+        # data may not have been read yet.
+        data = file.data
+        file.disk_address = self._find_space(file, best_fit)
+        self._write(file.disk_address, data)
+        file.data = data
+    
+    def write_catalogue(self, disk_title, files):
+    
+        """Writes the catalogue entries for the files given, which must
+        already have been stored on the disk, in order of decreasing start
+        sector as DFS expects."""
+        
+        if len(files) > self.max_files:
+            raise DiskError("Too many entries to write.")
+        
+        files = sorted(files, key = lambda file: file.disk_address, reverse = True)
+        
+        disk_title = self._pad(disk_title, 12, b"\x00")
         self._write(0, disk_title[:8])
-        self._write(0x100, disk_title[8:12])
         
-        # Write the number of files and the disk cycle.
+        # Write the end of the title, the disk cycle, the number of files,
+        # the disk size and boot option.
         self.disk_cycle += 1
-        self._write(0x104, self._write_unsigned_byte(self.disk_cycle))
-        self._write(0x105, self._write_unsigned_byte(len(files) * 8))
+        self._write(0x100, catalogue_info.pack(
+            disk_title[8:12], self.disk_cycle, min(len(files), 31) * 8, 0,
+            self.sectors, self.boot_option))
         
-        extra = (self.sectors >> 8) & 0x03
-        extra = extra | (self.boot_option << 4)
-        self._write(0x106, self._write_unsigned_byte(extra))
-        self._write(0x107, self._write_unsigned_byte(self.sectors & 0xff))
+        self._write_entries(0, files[:31])
+    
+    def _write_entries(self, base, files):
+    
+        names = []
+        addresses = []
         
-        p = 8
         for file in files:
         
-            prefix, name = file.name.split(".")
-            name = self._pad(name, 7, " ")
-            self._write(p, name)
-            
-            extra = ord(prefix)
-            if file.locked:
-                extra = extra | 128
-            
-            self._write(p + 7, self._write_unsigned_byte(extra))
-            
-            load = file.load_address
-            exec_ = file.execution_address
-            length = file.length
-            
-            self._write(0x100 + p, self._write_unsigned_half_word(load & 0xffff))
-            self._write(0x100 + p + 2, self._write_unsigned_half_word(exec_ & 0xffff))
-            self._write(0x100 + p + 4, self._write_unsigned_half_word(length & 0xffff))
-            
-            disk_address = self._find_space(file)
-            file_start_sector = disk_address / self.sector_size
-            self._write(disk_address, file.data)
+            prefix, name = file.name.split(b".")
+            names.append(catalogue_name.pack(
+                self._pad(name, 7, b" "), ord(prefix), bool(file.locked)))
             
-            extra = ((file_start_sector >> 8) & 0x03)
-            extra = extra | ((load >> 14) & 0x0c)
-            extra = extra | ((exec_ >> 12) & 0x30)
-            extra = extra | ((length >> 10) & 0xc0)
-            
-            self._write(0x100 + p + 6, self._write_unsigned_byte(extra))
-            self._write(0x100 + p + 7, self._write_unsigned_byte(file_start_sector & 0xff))
-            
-            p += 8
+            addresses.append(catalogue_address.pack(
+                file.load_address, file.execution_address, file.length, 0,
+                file.disk_address // self.sector_size))
+        
+        # The entries are stored at the same offsets in both sectors.
+        self._write(base + 8, b"".join(names))
+        self._write(base + 0x108, b"".join(addresses))
     
-    def _find_space(self, file):
+    def _find_space(self, file, best_fit = False):
     
-        for i in range(len(self.free_space)):
+        try:
+            sector = self.bitmap.allocate(self._sectors_used(file.length), best_fit)
+        except DiskError:
+            raise DiskError("Failed to find space for file: %s" % file.name)
         
-            sector, length = self.free_space[i]
-            file_length = file.length/self.sector_size
-            
-            if file.length % self.sector_size != 0:
-                file_length += 1
-            
-            if length >= file_length:
-            
-                if length > file_length:
-                    # Update the free space entry to contain the remaining space.
-                    self.free_space[i] = (sector + file_length, length - file_length)
-                else:
-                    # Remove the free space entry.
-                    del self.free_space[i]
-                
-                return sector * self.sector_size
+        return sector * self.sector_size
+
+
+class WatfordCatalogue(Catalogue):
+
+    """catalogue = WatfordCatalogue(file, sectors, sector_offsets)
+    
+    Reads and writes the Watford DFS catalogue, which holds up to 62 files
+    by storing entries for the files after the first 31 in an extended
+    catalogue in the third and fourth sectors of the disk.
+    """
+    
+    max_files = 62
+    catalogue_sectors = 4
+    
+    def is_present(self):
+    
+        """Returns True if the disk contains an extended catalogue."""
         
-        raise DiskError("Failed to find space for file: %s" % file.name)
+        return self._read(0x200, 8) == watford_marker
+    
+    def read(self):
+    
+        disk_title, files = Catalogue.read(self)
+        
+        extension = self._read(0x200, 0x200)
+        
+        if len(extension) == 0x200 and extension[:8] == watford_marker:
+            files += self._read_entries(extension, extension[0x105])
+        
+        return disk_title, files
+    
+    def write_catalogue(self, disk_title, files):
+    
+        Catalogue.write_catalogue(self, disk_title, files)
+        
+        files = sorted(files, key = lambda file: file.disk_address, reverse = True)
+        files = files[31:]
+        
+        # The extended catalogue contains a copy of the disk size and boot
+        # option from the standard catalogue.
+        self._write(0x200, watford_marker)
+        self._write(0x300, catalogue_info.pack(
+            b"", 0, len(files) * 8, 0, self.sectors, self.boot_option))
+        
+        self._write_entries(0x200, files)
 
 
 class Disk:
 
-    DiskSizes = {None: 200 * 1024}
-    SectorSizes = {None: 256}
-    Catalogues = {None: Catalogue}
+    """disk = Disk(format)
+    
+    Represents a disk image in one of the following formats:
+    
+    None or "ssd"   single-sided 80 track image
+    "ssd40"         single-sided 40 track image
+    "dsd"           double-sided 80 track image with interleaved tracks
+    "dsd40"         double-sided 40 track image with interleaved tracks
+    """
+    
+    DiskSizes = {None: 200 * 1024, "ssd": 200 * 1024, "ssd40": 100 * 1024,
+                 "dsd": 400 * 1024, "dsd40": 200 * 1024}
+    SectorSizes = {None: 256, "ssd": 256, "ssd40": 256, "dsd": 256, "dsd40": 256}
+    Catalogues = {None: Catalogue, "ssd": Catalogue, "ssd40": Catalogue,
+                  "dsd": Catalogue, "dsd40": Catalogue}
+    
+    # The number of tracks on each side and the number of sides
+    Geometries = {None: (80, 1), "ssd": (80, 1), "ssd40": (40, 1),
+                  "dsd": (80, 2), "dsd40": (40, 2)}
     
     def __init__(self, format = None):
     
+        if format not in self.Geometries:
+            raise DiskError("Unknown disk format: %s" % format)
+        
         self.format = format
+        
+        # The path and access mode of a memory-mapped disk image.
+        self.path = None
+        self.writable = False
+        
+        # Tables mapping the sectors on each side of a double-sided disk to
+        # offsets in the disk image. Single-sided images are stored in order.
+        tracks, sides = self.Geometries[format]
+        sector_size = self.SectorSizes[format]
+        self.sectors = tracks * sectors_per_track
+        
+        if sides == 1:
+            self.sector_tables = [None]
+        else:
+            self.sector_tables = [make_sector_table(tracks, sides, side, sector_size)
+                                  for side in range(sides)]
     
     def new(self):
     
+        """Creates an empty disk image in memory."""
+        
         self.size = self.DiskSizes[self.format]
-        self.data = "\x00" * self.size
-        self.file = StringIO.StringIO(self.data)
+        self.data = bytearray(self.size)
+        self.file = self.data
     
     def open(self, file_object):
     
         self.size = self.DiskSizes[self.format]
         self.file = file_object
     
-    def catalogue(self):
+    def map(self, file_object, writable = False):
+    
+        """Maps the disk image in the file object given into memory, so that
+        the data of each file read from the catalogue is a memoryview of the
+        mapping. If writable is True then data written to the disk is written
+        directly to the mapping and the underlying file."""
+        
+        self.size = self.DiskSizes[self.format]
+        
+        if writable:
+            access = mmap.ACCESS_WRITE
+        else:
+            access = mmap.ACCESS_READ
+        
+        try:
+            self.file = mmap.mmap(file_object.fileno(), 0, access = access)
+        except (OSError, ValueError):
+            raise DiskError("Failed to map the disk image into memory.")
+        
+        self.writable = writable
+    
+    def flush(self):
     
+        """Ensures that any data written to the disk has reached the file
+        containing the disk image."""
+        
+        self.file.flush()
+    
+    @classmethod
+    def from_fileobj(cls, file_object, format = None):
+    
+        """Returns a Disk object for the disk image in the binary file-like
+        object given."""
+        
+        disk = cls(format)
+        disk.open(file_object)
+        return disk
+    
+    @classmethod
+    def from_path(cls, path, format = None, writable = False):
+    
+        """Returns a Disk object for the disk image in the file with the path
+        given, using a memory mapping of the file. If writable is True then
+        changes to the disk are written directly to the file."""
+        
+        if writable:
+            mode = "r+b"
+        else:
+            mode = "rb"
+        
+        disk = cls(format)
+        
+        # The mapping remains valid after the file is closed.
+        f = open(path, mode)
+        try:
+            disk.map(f, writable)
+        finally:
+            f.close()
+        
+        disk.path = path
+        return disk
+    
+    @classmethod
+    def from_bytes(cls, data, format = None):
+    
+        """Returns a Disk object for the disk image contained in the bytes
+        given."""
+        
+        return cls.from_fileobj(BytesIO(data), format)
+    
+    def to_bytes(self):
+    
+        """Returns the contents of the disk image."""
+        
+        if isinstance(self.file, (bytearray, mmap.mmap)):
+            return bytes(self.file)
+        
+        self.file.seek(0, 0)
+        return self.file.read()
+    
+    def save(self, file):
+    
+        """Writes the disk image to the file with the path given or to a
+        binary file-like object."""
+        
+        # Mapped images are copied, since the file being written may be the
+        # one that is mapped.
+        if isinstance(self.file, bytearray):
+            data = self.file
+        else:
+            data = self.to_bytes()
+        
+        if hasattr(file, "write"):
+            file.write(data)
+        else:
+            f = open(file, "wb")
+            try:
+                f.write(data)
+            finally:
+                f.close()
+    
+    def catalogue(self, side = 0, watford = None):
+    
+        """Returns a catalogue for the side of the disk given. If watford is
+        True then the catalogue can hold 62 files using the Watford DFS
+        extended catalogue; if it is None then the extended catalogue is
+        used if the disk already contains one."""
+        
+        if not 0 <= side < len(self.sector_tables):
+            raise DiskError("The disk does not have a side %i." % side)
+        
         sector_size = self.SectorSizes[self.format]
-        return self.Catalogues[self.format](self.file)
+        table = self.sector_tables[side]
+        
+        if watford is None:
+            watford = WatfordCatalogue(self.file, self.sectors, table).is_present()
+        
+        if watford:
+            return WatfordCatalogue(self.file, self.sectors, table)
+        else:
+            return self.Catalogues[self.format](self.file, self.sectors, table)
@@ -0,0 +1,179 @@
+"""
+records.py - Describe the layouts of little endian binary records.
+
+Copyright (C) 2026 The ReptonMaps contributors
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import struct
+
+# The struct format characters used for unsigned integers of each width
+integer_formats = {1: "B", 2: "H", 4: "I"}
+
+# Compiled structures, shared between records with the same layout
+structures = {}
+
+def compile_struct(format):
+
+    """Returns a struct.Struct object for the format given, compiling it the
+    first time that the format is used."""
+
+    try:
+        return structures[format]
+    except KeyError:
+        structure = structures[format] = struct.Struct(format)
+        return structure
+
+
+def compile_function(arguments, expressions, sequence = False):
+
+    """Returns a function that accepts a sequence of values, assigning them
+    to the arguments given, and returns a tuple of the expressions given.
+    If sequence is True, the function accepts a sequence of sequences of
+    values instead, returning a list of tuples."""
+
+    arguments = ", ".join(arguments)
+    expressions = ", ".join(expressions)
+
+    if sequence:
+        source = "def function(records):\n    return [(%s,) for %s, in records]\n" % (
+            expressions, arguments)
+    else:
+        source = "def function(values):\n    %s, = values\n    return (%s,)\n" % (
+            arguments, expressions)
+
+    namespace = {}
+    exec(source, namespace)
+    return namespace["function"]
+
+
+class Record:
+
+    """record = Record(fields, bitfields = (), size = None)
+
+    Describes the layout of a little endian binary record. Each field is a
+    (name, offset, width) tuple, where the width is the number of bytes in an
+    unsigned integer (1, 2 or 4) or a struct format for a string, such as
+    "7s". Fields must be given in order of increasing offset. They are
+    compiled to a single struct.Struct, skipping any bytes between them and
+    padding the record to the size given, if any.
+
+    Each bitfield is a (name, field, mask, shift) tuple describing the bits
+    of an integer field, selected by the mask, that are shifted left by the
+    given number of bits, or right if the shift is negative, to obtain a
+    value. If the name is that of a field, the value supplies the high bits
+    of that field. Otherwise, it is an additional value that follows the
+    values of the fields.
+
+    Values are unpacked from buffers and packed into them as tuples in the
+    order given by the names attribute.
+    """
+
+    def __init__(self, fields, bitfields = (), size = None):
+
+        self.names = []
+        masks = []
+        format = "<"
+        end = 0
+
+        for name, offset, width in fields:
+
+            if offset < end:
+                raise ValueError("Field '%s' overlaps the one before it." % name)
+            elif offset > end:
+                format += "%ix" % (offset - end)
+
+            if isinstance(width, str):
+                format += width
+                end = offset + struct.calcsize("<" + width)
+            else:
+                format += integer_formats[width]
+                masks.append((len(self.names), (1 << (width * 8)) - 1))
+                end = offset + width
+
+            self.names.append(name)
+
+        if size is not None:
+            if size < end:
+                raise ValueError("Fields extend beyond the end of the record.")
+            elif size > end:
+                format += "%ix" % (size - end)
+
+        self.struct = compile_struct(format)
+        self.size = self.struct.size
+        self.fields = len(self.names)
+        self.bitfields = bitfields
+
+        for name, field, mask, shift in bitfields:
+            if name not in self.names:
+                self.names.append(name)
+
+        # Compile functions that combine the bitfields with the fields when
+        # records are unpacked and store them in the fields when packed.
+        values = ["v%i" % i for i in range(len(self.names))]
+        decoded = values[:self.fields] + ["0"] * (len(self.names) - self.fields)
+        encoded = values[:self.fields]
+
+        for name, field, mask, shift in bitfields:
+
+            target = self.names.index(name)
+            source = self.names.index(field)
+            left, right = max(shift, 0), max(-shift, 0)
+
+            decoded[target] = "(%s | (((v%i & %i) << %i) >> %i))" % (
+                decoded[target], source, mask, left, right)
+            encoded[source] = "(%s | (((v%i << %i) >> %i) & %i))" % (
+                encoded[source], target, right, left, mask)
+
+        for i, mask in masks:
+            encoded[i] = "%s & %i" % (encoded[i], mask)
+
+        self.decode = compile_function(values[:self.fields], decoded)
+        self.decode_all = compile_function(values[:self.fields], decoded, True)
+        self.encode = compile_function(values, encoded)
+
+    def unpack_from(self, buffer, offset = 0):
+
+        values = self.struct.unpack_from(buffer, offset)
+
+        if self.bitfields:
+            return self.decode(values)
+        else:
+            return values
+
+    def unpack_all(self, buffer, offset = 0, count = None):
+
+        """Returns a list of tuples of values from the consecutive records
+        stored in the buffer from the offset given, reading as many records
+        as will fit unless a count is given."""
+
+        if count is None:
+            count = (len(buffer) - offset) // self.size
+
+        records = self.struct.iter_unpack(
+            memoryview(buffer)[offset:offset + (count * self.size)])
+
+        if self.bitfields:
+            return self.decode_all(records)
+        else:
+            return list(records)
+
+    def pack(self, *values):
+
+        return self.struct.pack(*self.encode(values))
+
+    def pack_into(self, buffer, offset, *values):
+
+        self.struct.pack_into(buffer, offset, *self.encode(values))
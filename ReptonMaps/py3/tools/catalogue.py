@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+"""
+catalogue.py - A tool for cataloguing collections of UEF and SSD images.
+
+Copyright (C) 2026 The ReptonMaps contributors
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import functools, json, multiprocessing, os, sys
+
+import makedfs, UEFfile, UEFindex
+import Repton, Repton2
+
+suffixes = (".uef", ".uef.gz", ".ssd")
+
+# The name of each game, the class used to read it and the exceptions that
+# indicate that an image does not contain it
+games = (("Repton", Repton.Repton, (Repton.NotFound, Repton.IncorrectSize)),
+         ("Repton 2", Repton2.Repton2, (Repton2.NotFound, Repton2.IncorrectSize)))
+
+
+def find_images(paths):
+
+    for path in paths:
+
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        for dir_path, dir_names, file_names in os.walk(path):
+
+            dir_names.sort()
+
+            for file_name in sorted(file_names):
+                if file_name.lower().endswith(suffixes):
+                    yield os.path.join(dir_path, file_name)
+
+
+def file_record(name, load, exec_addr, length):
+
+    return {"name": name.decode("latin1"), "load": load, "exec": exec_addr,
+            "length": length}
+
+
+def catalogue_uef(path, record):
+
+    uef = UEFfile.UEFfile(path, lazy = True)
+
+    record["format"] = "uef"
+    record["files"] = [file_record(details["name"], details["load"],
+                                   details["exec"], len(details["data"]))
+                       for details in uef.contents]
+
+    for game_name, game, not_found in games:
+        try:
+            game.from_uef(uef)
+            record["games"].append(game_name)
+        except not_found:
+            pass
+
+    record["corrupt blocks"] = [list(block) for block in uef.verify()]
+
+
+def catalogue_uef_index(path, record):
+
+    # Use the index alongside the UEF file, creating it if necessary, so that
+    # the file only needs to be read when it has changed.
+    index = UEFindex.UEFIndex(path)
+
+    record["format"] = "uef"
+    record["files"] = [file_record(details["name"], details["load"],
+                                   details["exec"], details["length"])
+                       for details in index.contents]
+
+    for game_name, game, not_found in games:
+        if game.in_index(index):
+            record["games"].append(game_name)
+
+    record["corrupt blocks"] = [list(block) for block in index.verify()]
+
+
+def catalogue_ssd(path, record):
+
+    f = open(path, "rb")
+
+    try:
+        disk = makedfs.Disk.from_fileobj(f)
+        title, files = disk.catalogue().read()
+
+        record["format"] = "ssd"
+        record["title"] = title.rstrip(b"\x00 ").decode("latin1")
+        record["files"] = [file_record(file.name, file.load_address,
+                                       file.execution_address, file.length)
+                           for file in files]
+
+        for game_name, game, not_found in games:
+            try:
+                game.from_disk(disk)
+                record["games"].append(game_name)
+            except not_found:
+                pass
+    finally:
+        f.close()
+
+
+def catalogue(path, use_index = False):
+
+    record = {"path": path, "games": []}
+
+    try:
+        if path.lower().endswith(".ssd"):
+            catalogue_ssd(path, record)
+        elif use_index:
+            catalogue_uef_index(path, record)
+        else:
+            catalogue_uef(path, record)
+
+    except Exception as exception:
+        record["error"] = str(exception) or exception.__class__.__name__
+
+    return json.dumps(record)
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[1:]
+    processes = None
+    use_index = False
+
+    while args[:1] in (["-j"], ["-i"]):
+
+        if args[0] == "-i":
+            use_index = True
+            args = args[1:]
+            continue
+
+        try:
+            processes = int(args[1])
+            if processes < 1:
+                raise ValueError
+            args = args[2:]
+        except (IndexError, ValueError):
+            args = []
+
+    if not args:
+
+        sys.stderr.write("Usage: %s [-j <processes>] [-i] <directory or image file> ...\n\n" % sys.argv[0])
+        sys.stderr.write("-i  Use an index file alongside each UEF file, creating it if necessary.\n")
+        sys.exit(1)
+
+    # Write a JSON record for each image as soon as it has been read.
+    pool = multiprocessing.Pool(processes)
+    job = functools.partial(catalogue, use_index = use_index)
+
+    for line in pool.imap_unordered(job, find_images(args), 8):
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+    pool.close()
+    pool.join()
+
+    sys.exit()
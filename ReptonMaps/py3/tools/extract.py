@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+"""
+extract.py - A tool for extracting the files from collections of DFS disk
+images.
+
+Copyright (C) 2026 The ReptonMaps contributors
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib, multiprocessing, os, sys
+
+import makedfs
+
+suffixes = (".ssd", ".dsd")
+
+# Characters that cannot be used in the names of extracted files
+unsafe_characters = '/\\:*?"<>|'
+
+
+def find_images(paths):
+
+    """Generates the path of each disk image found in the paths given and the
+    path of the directory for its files relative to the output directory."""
+
+    for path in paths:
+
+        if not os.path.isdir(path):
+            yield path, os.path.basename(path)
+            continue
+
+        for dir_path, dir_names, file_names in os.walk(path):
+
+            dir_names.sort()
+
+            for file_name in sorted(file_names):
+                if file_name.lower().endswith(suffixes):
+                    image_path = os.path.join(dir_path, file_name)
+                    yield image_path, os.path.relpath(image_path, path)
+
+
+def safe_name(name):
+
+    new = ""
+    for c in name.decode("latin1"):
+        if c in unsafe_characters or not 32 < ord(c) < 127:
+            c = "_"
+        new += c
+
+    return new
+
+
+def inf_text(file):
+
+    text = "%s %06X %06X %06X" % (file.name.decode("latin1"), file.load_address,
+                                  file.execution_address, file.length)
+    if file.locked:
+        text += " L"
+
+    return (text + "\n").encode("latin1")
+
+
+def update_file(path, data):
+
+    """Writes the data to the file with the path given unless the file already
+    contains the same data, returning True if the file was written."""
+
+    try:
+        f = open(path, "rb")
+        try:
+            unchanged = hashlib.sha1(f.read()).digest() == hashlib.sha1(data).digest()
+        finally:
+            f.close()
+    except IOError:
+        unchanged = False
+
+    if unchanged:
+        return False
+
+    f = open(path, "wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+    return True
+
+
+def extract(job):
+
+    path, relative_path, output_dir = job
+
+    written = unchanged = 0
+
+    try:
+        if path.lower().endswith(".dsd"):
+            disk = makedfs.Disk.from_path(path, "dsd")
+        else:
+            disk = makedfs.Disk.from_path(path)
+
+        directory = os.path.join(output_dir, os.path.splitext(relative_path)[0])
+        sides = len(disk.sector_tables)
+
+        for side in range(sides):
+
+            title, files = disk.catalogue(side).read()
+            if not files:
+                continue
+
+            # The second side of a double-sided disk is drive 2.
+            if sides == 1:
+                side_dir = directory
+            else:
+                side_dir = os.path.join(directory, str(side * 2))
+
+            if not os.path.isdir(side_dir):
+                os.makedirs(side_dir)
+
+            for file in files:
+
+                name = os.path.join(side_dir, safe_name(file.name))
+
+                for file_name, data in ((name, file.data),
+                                        (name + ".inf", inf_text(file))):
+                    if update_file(file_name, data):
+                        written += 1
+                    else:
+                        unchanged += 1
+
+    except Exception as exception:
+        return "%s: %s" % (path, str(exception) or exception.__class__.__name__), False
+
+    return "%s: %i written, %i unchanged" % (path, written, unchanged), True
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[1:]
+    processes = None
+
+    if args[:1] == ["-j"]:
+        try:
+            processes = int(args[1])
+            if processes < 1:
+                raise ValueError
+            args = args[2:]
+        except (IndexError, ValueError):
+            args = []
+
+    if len(args) < 2:
+
+        sys.stderr.write("Usage: %s [-j <processes>] <output directory> <directory or image file> ...\n" % sys.argv[0])
+        sys.exit(1)
+
+    output_dir = args[0]
+    jobs = [(path, relative_path, output_dir)
+            for path, relative_path in find_images(args[1:])]
+
+    # Report on each image as soon as its files have been extracted.
+    pool = multiprocessing.Pool(processes)
+    failed = False
+
+    for message, ok in pool.imap_unordered(extract, jobs, 4):
+
+        if ok:
+            sys.stdout.write(message + "\n")
+            sys.stdout.flush()
+        else:
+            sys.stderr.write(message + "\n")
+            failed = True
+
+    pool.close()
+    pool.join()
+
+    if failed:
+        sys.exit(1)
+
+    sys.exit()